@@ -2,13 +2,59 @@
 # KrishiGPT - AI Agricultural Advisor Engine (Groq SDK + Redis persistence)
 
 import os
+import re
 import json
 import time
+import mmap
+import pickle
+import stat
+import random
+import string
+import bisect
+import hashlib
+import functools
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+import unicodedata
+import httpx
 import redis
+from collections import OrderedDict, deque, namedtuple
 from datetime import datetime, date
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, NotFoundError, APIConnectionError, APIStatusError
+
+try:
+    import ahocorasick  # pyahocorasick: single-pass multi-keyword matching
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # C JSON parser; stdlib json is the fallback
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # streaming parser for large knowledge bases
+except ImportError:
+    ijson = None
+
+try:
+    import tiktoken  # exact token counts for the history budget; a char estimate is the fallback
+    _TOKEN_ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKEN_ENC = None
+
+try:
+    import h2  # noqa: F401  (httpx[http2]); without it the Groq clients stay on HTTP/1.1
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Env (loaded before any module-level config below reads it)
+load_dotenv()
 
 # Simple crop stage rules (DAS = days after sowing)
 # You can refine ranges later.
@@ -56,12 +102,369 @@ def parse_date_str(date_str: str):
     return None
 
 
+# Per crop: sorted range ends, range starts and labels, for a bisect lookup by DAS
+_STAGE_INDEX = {
+    crop: (tuple(end for _, end, _ in rules), tuple(start for start, _, _ in rules),
+           tuple(label for _, _, label in rules))
+    for crop, rules in STAGE_RULES.items()
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _stage_for(crop_key, sowing_date_str, today_ordinal):
+    """(crop, das, label) for a sowing date as of today_ordinal, or None; memoized per day."""
+    index = _STAGE_INDEX.get(crop_key)
+    if not index:
+        return None
+    sow_date = parse_date_str(sowing_date_str)
+    if not sow_date:
+        return None
+    das = today_ordinal - sow_date.toordinal()
+    if das < 0:
+        return None
+
+    ends, starts, labels = index
+    i = bisect.bisect_left(ends, das)
+    label = labels[i] if i < len(ends) and starts[i] <= das else "अवस्था (अंदाजे)"
+    return crop_key, das, label
+
+
+# Query-type keywords
+DISEASE_KW = frozenset({
+    "रोग","बीमारी","कीट","सुंडी","मक्खी","इलाज","उपचार","पीला","पीले","सूख",
+    "मुरझा","धब्बे","छेद","सड़","disease","pest","treatment","yellow","dry","rot",
+    "अळी","माशी","किडा"
+})
+FERTILIZER_KW = frozenset({"खाद","উర్వরक","fertilizer","यूरिया","dap","npk","पोषक","nutrient","खत","मात्रा","कितना"})
+SCHEME_KW = frozenset({"योजना","scheme","सरकारी","government","सब्सिडी","pm-kisan","बीमा","kcc","क्रेडिट","loan"})
+IRRIGATION_KW = frozenset({"सिंचाई","पानी","water","irrigation","ड्रिप","drip","स्प्रिंकलर"})
+
+# Precedence order: first matching category wins
+QTYPE_KEYWORDS = (
+    ("disease", DISEASE_KW),
+    ("fertilizer", FERTILIZER_KW),
+    ("scheme", SCHEME_KW),
+    ("irrigation", IRRIGATION_KW),
+)
+
+KB_PATH = "prompts/crop_data.json"
+# How often (seconds) a running engine checks KB_PATH for edits; 0 disables
+KB_RELOAD_CHECK_SECONDS = float(os.getenv("KB_RELOAD_CHECK_SECONDS", "30"))
+
+# Top-level KB sections the engine uses; large KB files are stream-parsed for just these
+KB_SECTIONS = ("crops", "government_schemes", "emergency_contacts")
+KB_STREAM_MIN_BYTES = 1024 * 1024
+# Where the pickled KB is kept; defaults to next to the JSON. Must be a directory only
+# this service can write to: a pickle from anyone else would be code execution.
+KB_CACHE_DIR = os.getenv("KB_CACHE_DIR", "")
+
+# Everything derived from one load of the crop KB. A reload builds a new one and swaps
+# the single attribute, so a request never sees old and new structures mixed.
+KnowledgeBase = namedtuple("KnowledgeBase", "mtime version crop_data kw_ac crop_keys crop_re ctx_cache quick_info")
+
+# Groq HTTP timeouts (seconds)
+GROQ_TIMEOUT = httpx.Timeout(float(os.getenv("GROQ_TIMEOUT_SECONDS", "60")), connect=5.0)
+# Pooled keep-alive connections shared by every request (and thread) on a worker
+GROQ_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", "50")),
+    keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "120")),
+)
+
+# Model selection: last working model is cached on disk and trusted for a day
+MODEL_CACHE_FILE = "working_model.txt"
+MODEL_CACHE_MAX_AGE = 24 * 3600
+FALLBACK_MODELS = ("llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768")
+
+# Retry backoff for Groq calls: exponential from RETRY_BASE_DELAY, capped, with jitter
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# Messages of history kept per user (user + assistant turns)
+HISTORY_MAX_MESSAGES = 20
+# Of those, only the most recent that fit in this many tokens are sent to the model
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+
+# Reply used when Groq keeps failing
+FALLBACK_REPLY = ("❌ माफ करें, तकनीकी समस्या है। कृपया थोड़ी देर बाद प्रयास करें। 🙏\n"
+                  "अगर समस्या बनी रहे तो किसान कॉल सेंटर पर कॉल करें: 1551")
+
+# One compiled regex for the query type. Each category is a lookahead tried
+# in precedence order at the start of the text, so m.lastgroup is the
+# highest-precedence category present anywhere in the query.
+_QTYPE_RE = re.compile(
+    "^(?:" + "|".join(
+        f"(?=.*?(?:{'|'.join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True))}))(?P<{qtype}>)"
+        for qtype, keywords in QTYPE_KEYWORDS
+    ) + ")",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# Punctuation (ASCII + Devanagari danda) stripped before cache lookups / tokenizing
+_PUNCT = string.punctuation + "।॥"
+_PUNCT_TABLE = str.maketrans("", "", _PUNCT)
+
+
+# Semantic cache (opt-in: needs sentence-transformers, which pulls in torch)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_MODEL = os.getenv(
+    "SEMANTIC_CACHE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+# Directory with model.int8.onnx + tokenizer.json (scripts/export_embedder_onnx.py);
+# when set, embeddings run on onnxruntime instead of sentence-transformers/PyTorch
+SEMANTIC_CACHE_ONNX_DIR = os.getenv("SEMANTIC_CACHE_ONNX_DIR", "")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "10000"))
+# Min cosine similarity for the embedding fallback to assign a crop / query type
+SEMANTIC_NLU_MIN_SIM = float(os.getenv("SEMANTIC_NLU_MIN_SIM", "0.4"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", os.getenv("CONV_TTL_SECONDS", "604800")))
+
+
+def _canon(query: str) -> str:
+    """
+    Canonical form of a query for cache keys: NFKC, casefolded, no punctuation, single spaces.
+    NFKC folds the composed / decomposed nukta spellings and full-width forms that
+    phone keyboards produce, so the same question typed differently shares a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().translate(_PUNCT_TABLE).split())
+
+
+def _dumps(obj):
+    """JSON-encode for Redis (orjson bytes when available; both forms load back the same)."""
+    return orjson.dumps(obj) if orjson else json.dumps(obj)
+
+
+def _loads(s):
+    return orjson.loads(s) if orjson else json.loads(s)
+
+
+def _retry_delay(exc, attempt):
+    """
+    Seconds to wait before retrying a failed Groq call, or None when retrying
+    can't help (4xx other than 429, or a non-network error). Honors Retry-After.
+    """
+    if isinstance(exc, APIStatusError):
+        if exc.status_code != 429 and exc.status_code < 500:
+            return None
+        retry_after = exc.response.headers.get("retry-after") if exc.response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    elif not isinstance(exc, (APIConnectionError, httpx.TransportError)):
+        return None
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+@functools.lru_cache(maxsize=4096)
+def _count_tokens(text):
+    """Token count of a message (memoized, so older turns aren't re-tokenized every request)."""
+    if _TOKEN_ENC is not None:
+        return len(_TOKEN_ENC.encode(text))
+    # Rough fallback: Llama-style tokenizers average ~3 chars/token over mixed Devanagari/Latin text
+    return len(text) // 3 + 1
+
+
+def _trim_history(history, budget=HISTORY_TOKEN_BUDGET):
+    """Most recent messages whose total token count fits the budget, starting on a user turn."""
+    kept, used = [], 0
+    for m in reversed(history):
+        used += _count_tokens(m.get("content") or "")
+        if used > budget:
+            break
+        kept.append(m)
+    kept.reverse()
+    while kept and kept[0].get("role") != "user":
+        kept.pop(0)
+    return kept
+
+
+def _file_fingerprint(path):
+    """b"<size> <blake2b>" of a file's bytes; what a KB pickle and the response-cache keys are tied to."""
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+            size += len(block)
+    return b"%d %s" % (size, digest.hexdigest().encode())
+
+
+def _trusted_cache_file(f):
+    """True if an open cache file is ours and not writable by group / others."""
+    st = os.fstat(f.fileno())
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+@functools.lru_cache(maxsize=None)
+def _read_text(path):
+    """File contents, read once per process (prompt files don't change while running)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
 # Logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Request threads only enqueue records; one listener thread does the stdout writes.
+# (Started at import, i.e. per gunicorn worker unless --preload is used.)
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+# Vercel / journald stamp every line themselves; LOG_TIMESTAMPS=0 skips the per-record strftime
+_log_format = ("%(asctime)s - " if os.getenv("LOG_TIMESTAMPS", "1") == "1" else "") + "%(levelname)s - %(message)s"
+_log_stream.setFormatter(logging.Formatter(_log_format))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_log_enqueue = logging.handlers.QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))  # final format is applied by _log_stream
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_log_enqueue])
 logger = logging.getLogger(__name__)
 
-# Env
-load_dotenv()
+
+class OnnxEmbedder:
+    """
+    Minimal sentence-transformers stand-in for an INT8-quantized ONNX export:
+    tokenizers (Rust) for tokenization, mean pooling over the attention mask.
+    """
+    def __init__(self, model_dir, max_length=128):
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self._np = np
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.intra_op_num_threads = int(os.getenv("ONNX_THREADS", "2"))
+        self._sess = ort.InferenceSession(
+            os.path.join(model_dir, "model.int8.onnx"), opts, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self._sess.get_inputs()}
+        self._tok = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tok.enable_padding()
+        self._tok.enable_truncation(max_length=max_length)
+        self._dim = int(self.encode("test").shape[-1])
+
+    def get_sentence_embedding_dimension(self):
+        return self._dim
+
+    def encode(self, texts, normalize_embeddings=True):
+        np = self._np
+        single = isinstance(texts, str)
+        encodings = self._tok.encode_batch([texts] if single else list(texts))
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(ids)
+        hidden = self._sess.run(None, feed)[0]
+        weights = mask[..., None].astype(np.float32)
+        vecs = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if normalize_embeddings:
+            vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        return vecs[0] if single else vecs
+
+
+class SemanticCache:
+    """
+    Near-duplicate answer cache: a query whose embedding is within
+    `threshold` cosine similarity of a cached one reuses its answer.
+
+    Entries are keyed like the exact response cache; everything but the
+    canonical query (model, KB version, crop, qtype, last-turn hash) is the namespace,
+    so only questions asked in the same context can match. Vectors live in
+    a fixed-size ring buffer searched with one matrix-vector product;
+    entries older than `ttl` seconds no longer match.
+    """
+    def __init__(self, model_name=SEMANTIC_CACHE_MODEL, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_SIZE, ttl=SEMANTIC_CACHE_TTL):
+        import numpy as np
+
+        self._np = np
+        if SEMANTIC_CACHE_ONNX_DIR:
+            self._embedder = OnnxEmbedder(SEMANTIC_CACHE_ONNX_DIR)
+        else:
+            from sentence_transformers import SentenceTransformer
+            self._embedder = SentenceTransformer(model_name)
+        dim = self._embedder.get_sentence_embedding_dimension()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._vecs = np.zeros((max_entries, dim), dtype=np.float32)
+        self._ns = np.zeros(max_entries, dtype=np.int64)
+        self._ts = np.zeros(max_entries, dtype=np.float64)
+        self._answers = [None] * max_entries
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        # classify(), get() and put() for one turn embed the same text; keep recent vectors
+        self._emb_memo = OrderedDict()
+        self._labels = {}
+
+    @staticmethod
+    def _split(cache_key):
+        text = cache_key[4]
+        return text, hash(cache_key[:4] + cache_key[5:])
+
+    def _embed(self, text):
+        with self._lock:
+            vec = self._emb_memo.get(text)
+        if vec is None:
+            vec = self._embedder.encode(text, normalize_embeddings=True).astype(self._np.float32)
+            with self._lock:
+                self._emb_memo[text] = vec
+                while len(self._emb_memo) > 1024:
+                    self._emb_memo.popitem(last=False)
+        return vec
+
+    def set_labels(self, kind, texts):
+        """Embed one description per label ({label: text}) for zero-shot classify(kind, ...)."""
+        keys = list(texts)
+        if not keys:
+            self._labels.pop(kind, None)
+            return
+        mat = self._embedder.encode([texts[k] for k in keys], normalize_embeddings=True)
+        self._labels[kind] = (keys, mat.astype(self._np.float32))
+
+    def classify(self, kind, text, min_sim=SEMANTIC_NLU_MIN_SIM):
+        """Closest label of `kind` to the text, or None below min_sim."""
+        labels = self._labels.get(kind)
+        if not labels or not text:
+            return None
+        keys, mat = labels
+        sims = mat @ self._embed(text)
+        i = int(sims.argmax())
+        return keys[i] if sims[i] >= min_sim else None
+
+    def get(self, cache_key):
+        text, ns = self._split(cache_key)
+        if not text or not self._count:
+            return None
+        vec = self._embed(text)
+        with self._lock:
+            n = self._count
+            sims = self._vecs[:n] @ vec
+            sims[(self._ns[:n] != ns) | (self._ts[:n] < time.time() - self.ttl)] = -1.0
+            i = int(sims.argmax())
+            if sims[i] >= self.threshold:
+                return self._answers[i]
+        return None
+
+    def put(self, cache_key, answer):
+        text, ns = self._split(cache_key)
+        if not text:
+            return
+        vec = self._embed(text)
+        with self._lock:
+            i = self._next
+            self._vecs[i] = vec
+            self._ns[i] = ns
+            self._ts[i] = time.time()
+            self._answers[i] = answer
+            self._next = (i + 1) % self.max_entries
+            self._count = min(self._count + 1, self.max_entries)
 
 
 class KrishiGPT:
@@ -70,27 +473,45 @@ class KrishiGPT:
     Supports Hindi and Marathi languages
     """
     def __init__(self):
-        print("🌾 Initializing KrishiGPT...")
+        logger.info("🌾 Initializing KrishiGPT...")
 
         # ---- LLM client (Groq) ----
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
             raise ValueError("GROQ_API_KEY not found in environment variables!")
-        self.client = Groq(api_key=api_key)
+        self.client = self._build_groq_client(api_key)
 
         # Pick a working model (env override → cached → fallback list)
         self.model = self._find_working_model()
-        print(f"✅ Using model: {self.model}")
+        logger.info("✅ Using model: %s", self.model)
 
         # ---- Prompts & KB ----
         self.system_prompt = self._load_system_prompt()
-        print("✅ System prompt loaded")
+        logger.info("✅ System prompt loaded")
 
-        self.crop_data = self._load_crop_data()
-        print(f"✅ Crop database loaded ({len(self.crop_data.get('crops', {}))} crops)")
+        self._kb_reload_lock = threading.Lock()
+        self._kb_checked_at = time.monotonic()
+        self._load_kb()
+        logger.info("✅ Crop database loaded (%d crops)", len(self.crop_data.get("crops", {})))
 
         # ---- Memory stores ----
-        self.conversations = {}  # in-memory fallback
+        # In-memory fallback history: user_id -> (saved_at, deque), LRU-capped and
+        # expiring after history_ttl like the Redis keys, so one-off users don't pile up
+        self.conversations = OrderedDict()
+        self._conv_lock = threading.Lock()
+        self.max_users = int(os.getenv("CONV_MAX_USERS", "10000"))
+
+        # Response cache: (model, KB version, crop, qtype, canonical query, last-turn hash) -> answer.
+        # Local LRU in front of Redis, which shares answers across workers when connected.
+        self.response_cache = OrderedDict()
+        self.response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+        self.response_cache_ttl = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+        self._cache_lock = threading.Lock()
+        self.semantic_cache = self._build_semantic_cache()
+
+        # get_response() single-flight: cache key -> Event set when the leader finishes
+        self._sync_inflight = {}
+        self._sync_inflight_lock = threading.Lock()
 
         # Redis (Render Key Value)
         self.redis = None
@@ -99,143 +520,361 @@ class KrishiGPT:
         redis_url = os.getenv("REDIS_URL")
         if redis_url:
             try:
-                self.redis = redis.from_url(redis_url, decode_responses=True)
+                # Blocking pool: under gevent many greenlets share a few sockets and wait for a free one.
+                # Short socket timeouts keep a stalled Redis from eating the request budget (every
+                # caller already falls back to local state), and idle sockets are pinged before reuse.
+                socket_timeout = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+                pool = redis.BlockingConnectionPool.from_url(
+                    redis_url, decode_responses=True,
+                    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "20")), timeout=5,
+                    socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout,
+                    health_check_interval=30,
+                )
+                self.redis = redis.Redis(connection_pool=pool)
                 self.redis.ping()
                 self.kv_ready = True
-                print("✅ Redis connected")
+                logger.info("✅ Redis connected")
             except Exception as e:
-                print(f"⚠️ Redis not available: {e}")
+                logger.warning("⚠️ Redis not available: %s", e)
                 self.redis = None
                 self.kv_ready = False
 
         # Mark AI ready after a quick ping
         self.ai_ready = True
-        print("🚀 KrishiGPT is ready!\n")
+        logger.info("🚀 KrishiGPT is ready!")
+
+    # ---------------- LLM clients ----------------
+    def _build_groq_client(self, api_key):
+        """Groq client shared by request threads.
+
+        It reuses one pooled httpx client (HTTP/2 when h2 is installed), so
+        sequential requests skip the TCP/TLS handshake.
+        """
+        http_opts = dict(http2=HTTP2_AVAILABLE, timeout=GROQ_TIMEOUT, limits=GROQ_LIMITS)
+        return Groq(api_key=api_key, http_client=httpx.Client(**http_opts))
 
     # ---------------- Model selection ----------------
-    def _find_working_model(self):
-        # 1) Env override
+    def _probe_model(self, model_name):
+        self.client.chat.completions.create(
+            model=model_name, messages=[{"role": "user", "content": "test"}], max_tokens=5
+        )
+
+    def _available_models(self):
+        """Model ids Groq currently serves (one cheap list call), or None if listing failed."""
+        try:
+            return {m.id for m in self.client.models.list().data}
+        except Exception as e:
+            logger.warning("Could not list Groq models: %s", e)
+            return None
+
+    def _find_working_model(self, validate=None, exclude=()):
+        """
+        Env override → cached working_model.txt → fallback list.
+        The env model, or a cached model under MODEL_CACHE_MAX_AGE old, is
+        trusted without any network call unless KRISHIGPT_VALIDATE_MODEL is
+        set (or validate=True after a model error). Otherwise the first
+        candidate in Groq's model list wins; probe calls are only the
+        fallback for when the list itself can't be fetched.
+        """
+        if validate is None:
+            validate = bool(os.getenv("KRISHIGPT_VALIDATE_MODEL"))
+
         env_model = (os.getenv("LLM_MODEL") or "").strip()
-        if env_model:
-            try:
-                self.client.chat.completions.create(
-                    model=env_model, messages=[{"role": "user", "content": "test"}], max_tokens=5
-                )
+        saved, saved_age = "", None
+        try:
+            with open(MODEL_CACHE_FILE, "r") as f:
+                saved = f.read().strip()
+            saved_age = time.time() - os.path.getmtime(MODEL_CACHE_FILE)
+        except OSError:
+            pass
+
+        if not validate:
+            if env_model:
                 return env_model
-            except Exception as e:
-                logger.warning(f"LLM_MODEL '{env_model}' failed: {e}. Falling back…")
+            if saved and saved_age < MODEL_CACHE_MAX_AGE:
+                return saved
 
-        # 2) Cached previous (ephemeral file)
-        if os.path.exists("working_model.txt"):
-            try:
-                with open("working_model.txt", "r") as f:
-                    saved = f.read().strip()
-                if saved:
-                    self.client.chat.completions.create(
-                        model=saved, messages=[{"role": "user", "content": "test"}], max_tokens=5
-                    )
-                    return saved
-            except Exception:
-                pass
-
-        # 3) Fallback list
-        models_to_try = [
-            "llama3-70b-8192",
-            "llama3-8b-8192",
-            "mixtral-8x7b-32768",
-        ]
-        for model_name in models_to_try:
+        candidates = [m for m in dict.fromkeys([env_model, saved, *FALLBACK_MODELS])
+                      if m and m not in exclude]
+        available = self._available_models()
+        chosen = None
+        if available is not None:
+            chosen = next((m for m in candidates if m in available), None)
+        else:
+            for model_name in candidates:
+                try:
+                    self._probe_model(model_name)
+                    chosen = model_name
+                    break
+                except Exception:
+                    continue
+        if chosen is None:
+            raise RuntimeError("No working model found on Groq!")
+
+        if chosen != saved or saved_age is None or saved_age >= MODEL_CACHE_MAX_AGE:
             try:
-                self.client.chat.completions.create(
-                    model=model_name, messages=[{"role": "user", "content": "test"}], max_tokens=5
-                )
-                with open("working_model.txt", "w") as f:
-                    f.write(model_name)
-                return model_name
-            except Exception:
-                continue
-        raise RuntimeError("No working model found on Groq!")
+                with open(MODEL_CACHE_FILE, "w") as f:
+                    f.write(chosen)
+            except OSError as e:
+                logger.warning("Could not write %s: %s", MODEL_CACHE_FILE, e)
+        return chosen
+
+    def _is_model_error(self, exc):
+        """True when Groq rejected the model itself (removed / decommissioned)."""
+        if isinstance(exc, NotFoundError):
+            return True
+        text = str(exc).lower()
+        return "model_not_found" in text or "decommissioned" in text
+
+    def _reselect_model(self, exc):
+        """Drop the cached model and pick a new one after a model error. Returns True if switched."""
+        if not self._is_model_error(exc):
+            return False
+        logger.warning("Model '%s' rejected by Groq, re-selecting…", self.model)
+        try:
+            self.model = self._find_working_model(validate=True, exclude=(self.model,))
+        except Exception as e:
+            logger.error("Model re-selection failed: %s", e)
+            return False
+        logger.info("Switched to model: %s", self.model)
+        return True
 
     # ---------------- Data loading ----------------
     def _load_system_prompt(self):
         prompt_path = "prompts/system_prompt.txt"
         if os.path.exists(prompt_path):
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                return f.read()
+            return _read_text(prompt_path)
         return (
             "तुम KrishiGPT हो - भारतीय किसानों के लिए AI कृषि सलाहकार। "
             "हिंदी और मराठी में जवाब दो। व्यावहारिक, सुरक्षित, और स्पष्ट सलाह दो।"
         )
 
-    def _load_crop_data(self):
-        data_path = "prompts/crop_data.json"
-        if os.path.exists(data_path):
-            with open(data_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return {"crops": {}, "government_schemes": [], "emergency_contacts": {}}
+    @staticmethod
+    def _kb_mtime():
+        try:
+            return os.path.getmtime(KB_PATH)
+        except OSError:
+            return None
+
+    def _load_kb(self):
+        """Load the crop KB, rebuild everything precomputed from it, then publish it in one assignment."""
+        mtime = self._kb_mtime()
+        fingerprint = _file_fingerprint(KB_PATH) if mtime is not None else b""
+        crop_data = self._load_crop_data(fingerprint)
+        self._kb = KnowledgeBase(
+            mtime=mtime,
+            # Part of every response-cache key, so answers built from an older KB
+            # (in Redis too, across workers) stop matching once it is reloaded
+            version=fingerprint.rpartition(b" ")[2][:16].decode(),
+            crop_data=crop_data,
+            kw_ac=self._build_keyword_automaton(crop_data),
+            crop_keys=tuple(crop_data.get("crops", {})),
+            crop_re=self._build_crop_regex(crop_data),
+            ctx_cache=self._build_context_cache(crop_data),
+            quick_info=self._build_quick_info(crop_data),
+        )
+        if getattr(self, "semantic_cache", None):
+            self._set_semantic_labels(self.semantic_cache, crop_data)
+
+    @property
+    def crop_data(self):
+        return self._kb.crop_data
+
+    def _maybe_reload_kb(self):
+        """Reload the KB if crop_data.json changed; the stat runs at most every KB_RELOAD_CHECK_SECONDS."""
+        if not KB_RELOAD_CHECK_SECONDS:
+            return
+        now = time.monotonic()
+        if now - self._kb_checked_at < KB_RELOAD_CHECK_SECONDS:
+            return
+        # One thread checks / rebuilds; the others keep serving the current KB meanwhile
+        if not self._kb_reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._kb_checked_at = now
+            if self._kb_mtime() == self._kb.mtime:
+                return
+            logger.info("Crop KB changed on disk, reloading")
+            self._load_kb()
+            with self._cache_lock:
+                self.response_cache.clear()  # old keys can't match the new KB version; free them
+        finally:
+            self._kb_reload_lock.release()
+
+    def _load_crop_data(self, fingerprint):
+        data_path = KB_PATH
+        if not fingerprint:
+            return {"crops": {}, "government_schemes": [], "emergency_contacts": {}}
+
+        # Pickled copy of the parsed KB. The file starts with a header line holding the
+        # JSON's size and hash; it is only unpickled when that matches and the file is ours.
+        cache_path = data_path + ".pkl"
+        if KB_CACHE_DIR:
+            cache_path = os.path.join(KB_CACHE_DIR, os.path.basename(cache_path))
+        header = b"krishigpt-kb " + fingerprint + b"\n"
+        try:
+            with open(cache_path, "rb") as f:
+                if _trusted_cache_file(f) and f.read(len(header)) == header:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+                        return pickle.loads(view[len(header):])
+        except Exception:
+            pass  # missing, foreign, stale or unreadable cache → parse JSON
+
+        if ijson is not None and os.path.getsize(data_path) >= KB_STREAM_MIN_BYTES:
+            # Big KB: one streaming pass per section we use; other sections are only
+            # tokenized, never built into objects
+            data = {}
+            for section in KB_SECTIONS:
+                with open(data_path, "rb") as f:
+                    for value in ijson.items(f, section, use_float=True):
+                        data[section] = value
+                        break
+        else:
+            with open(data_path, "rb") as f:
+                raw = f.read()
+            data = _loads(raw)
+        # Write-then-rename so workers starting together never read a half-written file;
+        # created 0644 so the trust check above accepts it
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                pickle.dump(data, f, protocol=5)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning("Could not write crop data cache: %s", e)
+        return data
 
     # ---------------- NLU helpers ----------------
-    def _detect_crop(self, query):
+    def _build_keyword_automaton(self, crop_data):
+        """
+        Compile crop and query-type keywords into one Aho-Corasick automaton.
+        Each keyword maps to a tuple of (kind, rank, tag) hits, kind being
+        "crop" or "qtype"; the lowest rank wins so KB / category order is kept.
+        Returns None when pyahocorasick is not installed.
+        """
+        if ahocorasick is None:
+            return None
+
+        entries = [("crop", rank, crop_key, info.get("keywords", []))
+                   for rank, (crop_key, info) in enumerate(crop_data.get("crops", {}).items())]
+        entries += [("qtype", rank, qtype, keywords)
+                    for rank, (qtype, keywords) in enumerate(QTYPE_KEYWORDS)]
+
+        hits_by_kw = {}
+        for kind, rank, tag, keywords in entries:
+            for kw in keywords:
+                kw = kw.lower()
+                if kw:
+                    hits_by_kw.setdefault(kw, []).append((kind, rank, tag))
+        if not hits_by_kw:
+            return None
+
+        automaton = ahocorasick.Automaton()
+        for kw, hits in hits_by_kw.items():
+            automaton.add_word(kw, tuple(hits))
+        automaton.make_automaton()
+        return automaton
+
+    def _classify(self, query, kb):
+        """Return (crop_key or None, qtype) from a single pass over the query."""
         q = query.lower()
-        for crop_key, crop_info in self.crop_data.get("crops", {}).items():
-            for kw in crop_info.get("keywords", []):
-                if kw.lower() in q:
-                    return crop_key, crop_info
-        return None, None
+        if kb.kw_ac is None:
+            crop_key, _ = self._detect_crop(q, kb)
+            return crop_key, self._detect_query_type(q)
+
+        best = {"crop": None, "qtype": None}
+        for _, hits in kb.kw_ac.iter(q):
+            for kind, rank, tag in hits:
+                if best[kind] is None or rank < best[kind][0]:
+                    best[kind] = (rank, tag)
+        crop_key = best["crop"][1] if best["crop"] else None
+        qtype = best["qtype"][1] if best["qtype"] else "general"
+        return crop_key, qtype
+
+    # Fallbacks when pyahocorasick is unavailable: one regex each for crop and query type
+    def _build_crop_regex(self, crop_data):
+        """
+        Crop regex for _detect_crop, built like _QTYPE_RE: one lookahead per crop in
+        KB order, each matching any of its keywords as a substring, so inflected
+        forms ("टमाटरों") still hit and m.lastgroup is the first crop present.
+        Groups are named c0, c1, ... after the crop's KB position.
+        """
+        branches = []
+        for rank, info in enumerate(crop_data.get("crops", {}).values()):
+            keywords = sorted({kw.lower().strip() for kw in info.get("keywords", [])} - {""}, key=len, reverse=True)
+            if keywords:
+                branches.append(f"(?=.*?(?:{'|'.join(map(re.escape, keywords))}))(?P<c{rank}>)")
+        if not branches:
+            return None
+        return re.compile("^(?:" + "|".join(branches) + ")", re.DOTALL)
+
+    def _detect_crop(self, query, kb):
+        m = kb.crop_re.search(query.lower()) if kb.crop_re is not None else None
+        if not m:
+            return None, None
+        crop_key = kb.crop_keys[int(m.lastgroup[1:])]
+        return crop_key, kb.crop_data["crops"][crop_key]
 
     def _detect_query_type(self, query):
-        q = query.lower()
-        disease_keywords = [
-            "रोग","बीमारी","कीट","सुंडी","मक्खी","इलाज","उपचार","पीला","पीले","सूख",
-            "मुरझा","धब्बे","छेद","सड़","disease","pest","treatment","yellow","dry","rot",
-            "अळी","माशी","किडा"
-        ]
-        fertilizer_keywords = ["खाद","উర్వরक","fertilizer","यूरिया","dap","npk","पोषक","nutrient","खत","मात्रा","कितना"]
-        scheme_keywords = ["योजना","scheme","सरकारी","government","सब्सिडी","pm-kisan","बीमा","kcc","क्रेडिट","loan"]
-        irrigation_keywords = ["सिंचाई","पानी","water","irrigation","ड्रिप","drip","स्प्रिंकलर"]
-
-        if any(kw in q for kw in disease_keywords): return "disease"
-        if any(kw in q for kw in fertilizer_keywords): return "fertilizer"
-        if any(kw in q for kw in scheme_keywords): return "scheme"
-        if any(kw in q for kw in irrigation_keywords): return "irrigation"
-        return "general"
-
-    def _get_relevant_context(self, query):
+        m = _QTYPE_RE.search(query.lower())
+        return m.lastgroup if m else "general"
+
+    def _build_context_cache(self, crop_data):
+        """Pre-render the KB context for every (crop_key, qtype) pair; crop_key None = no crop."""
+        qtypes = [qtype for qtype, _ in QTYPE_KEYWORDS] + ["general"]
+        crops = [(None, None)] + list(crop_data.get("crops", {}).items())
+        cache = {}
+        for crop_key, crop_info in crops:
+            for qtype in qtypes:
+                ctx = self._format_context(crop_key, crop_info, qtype, crop_data)
+                if ctx:
+                    cache[(crop_key, qtype)] = ctx
+        return cache
+
+    def _get_relevant_context(self, kb, crop_key, qtype):
+        return kb.ctx_cache.get((crop_key, qtype), "")
+
+    def _format_context(self, crop_key, crop_info, qtype, crop_data):
         parts = []
-        crop_key, crop_info = self._detect_crop(query)
-        qtype = self._detect_query_type(query)
 
         if crop_info:
-            parts.append(f"\n📌 फसल ({crop_info.get('name_hi', crop_key)}):")
-            parts.append(f"   - मौसम: {crop_info.get('season', 'N/A')}")
-            parts.append(f"   - पानी: {crop_info.get('water_requirement', 'N/A')}")
+            name_hi = crop_info.get("name_hi", crop_key)
+            season = crop_info.get("season", "N/A")
+            water = crop_info.get("water_requirement", "N/A")
+            parts.extend([f"\n📌 फसल ({name_hi}):", f"   - मौसम: {season}", f"   - पानी: {water}"])
             if qtype == "disease":
                 parts.append("\n🔬 आम बीमारियां:")
                 for disease in crop_info.get("common_diseases", [])[:3]:
-                    parts.append(f"\n   {disease.get('name','')}:")
-                    parts.append(f"   लक्षण: {disease.get('symptoms','N/A')}")
-                    parts.append(f"   कारण: {disease.get('causes','N/A')}")
-                    parts.append(f"   उपचार:")
-                    for treatment in disease.get("treatment", []):
-                        parts.append(f"      • {treatment}")
+                    name = disease.get("name", "")
+                    symptoms = disease.get("symptoms", "N/A")
+                    causes = disease.get("causes", "N/A")
+                    parts.extend([f"\n   {name}:", f"   लक्षण: {symptoms}", f"   कारण: {causes}", "   उपचार:"])
+                    parts.extend([f"      • {treatment}" for treatment in disease.get("treatment", [])])
                     if "cost_per_acre" in disease:
                         parts.append(f"   खर्च: ₹{disease['cost_per_acre']}/एकड़")
-            if qtype in ["fertilizer","general"]:
+            if qtype in ("fertilizer", "general"):
                 parts.append("\n🌿 खाद अनुसूची:")
                 for schedule in crop_info.get("fertilizer_schedule", []):
-                    parts.append(f"   • {schedule.get('stage','')}: {schedule.get('fertilizer','')}")
-                    if schedule.get('cost'):
-                        parts.append(f"     खर्च: ₹{schedule['cost']}")
+                    stage = schedule.get("stage", "")
+                    fertilizer = schedule.get("fertilizer", "")
+                    cost = schedule.get("cost")
+                    parts.append(f"   • {stage}: {fertilizer}")
+                    if cost:
+                        parts.append(f"     खर्च: ₹{cost}")
 
         if qtype == "scheme":
             parts.append("\n📋 सरकारी योजनाएं:")
-            for scheme in self.crop_data.get("government_schemes", []):
-                parts.append(f"\n   {scheme.get('name','')}:")
-                parts.append(f"   लाभ: {scheme.get('benefit','N/A')}")
-                parts.append(f"   पात्रता: {scheme.get('eligibility','N/A')}")
-                parts.append(f"   आवेदन: {scheme.get('apply','N/A')}")
-                if scheme.get('helpline'):
-                    parts.append(f"   हेल्पलाइन: {scheme['helpline']}")
+            for scheme in crop_data.get("government_schemes", []):
+                name = scheme.get("name", "")
+                benefit = scheme.get("benefit", "N/A")
+                eligibility = scheme.get("eligibility", "N/A")
+                apply = scheme.get("apply", "N/A")
+                helpline = scheme.get("helpline")
+                parts.extend([f"\n   {name}:", f"   लाभ: {benefit}", f"   पात्रता: {eligibility}", f"   आवेदन: {apply}"])
+                if helpline:
+                    parts.append(f"   हेल्पलाइन: {helpline}")
 
         return "\n".join(parts) if parts else ""
 
@@ -249,65 +888,185 @@ class KrishiGPT:
         if not crop_key or not sowing_date_str:
             return None
 
-        crop_key = str(crop_key).lower()
-        rules = STAGE_RULES.get(crop_key)
-        if not rules:
-            return None
-
-        sow_date = parse_date_str(sowing_date_str)
-        if not sow_date:
+        stage = _stage_for(str(crop_key).lower(), str(sowing_date_str), date.today().toordinal())
+        if not stage:
             return None
-
-        today = date.today()
-        das = (today - sow_date).days
-        if das < 0:
-            return None
-
-        stage_label = "अवस्था (अंदाजे)"
-        for start, end, label in rules:
-            if start <= das <= end:
-                stage_label = label
-                break
-
-        return {"crop": crop_key, "das": das, "label": stage_label}
+        crop, das, label = stage
+        return {"crop": crop, "das": das, "label": label}
 
     # ---------------- Redis helpers ----------------
     def _conv_key(self, user_id):
         return f"conv:{user_id}"
 
     def _get_history(self, user_id):
+        """History as a deque capped at HISTORY_MAX_MESSAGES; appends evict the oldest turn."""
         if self.redis:
             try:
                 s = self.redis.get(self._conv_key(user_id))
-                return json.loads(s) if s else []
+                return deque(_loads(s) if s else (), maxlen=HISTORY_MAX_MESSAGES)
             except Exception as e:
-                logger.warning(f"Redis get failed, falling back to memory: {e}")
+                logger.warning("Redis get failed, falling back to memory: %s", e)
                 self.redis = None
                 self.kv_ready = False
-        return self.conversations.get(user_id, [])
+        with self._conv_lock:
+            entry = self.conversations.get(user_id)
+            if entry is None:
+                return deque(maxlen=HISTORY_MAX_MESSAGES)
+            saved_at, msgs = entry
+            if time.monotonic() - saved_at > self.history_ttl:
+                del self.conversations[user_id]
+                return deque(maxlen=HISTORY_MAX_MESSAGES)
+            self.conversations.move_to_end(user_id)
+            return msgs
 
-    def _set_history(self, user_id, msgs):
-        msgs = msgs[-20:]  # keep last 20
+    def _set_history(self, user_id, msgs, pipe=None):
+        """Save history; with a Redis pipeline the write is only queued on it."""
+        if not isinstance(msgs, deque):
+            msgs = deque(msgs, maxlen=HISTORY_MAX_MESSAGES)
+        if pipe is not None:
+            pipe.setex(self._conv_key(user_id), self.history_ttl, _dumps(list(msgs)))
+            return
         if self.redis:
             try:
-                self.redis.setex(self._conv_key(user_id), self.history_ttl, json.dumps(msgs))
+                self.redis.setex(self._conv_key(user_id), self.history_ttl, _dumps(list(msgs)))
                 return
             except Exception as e:
-                logger.warning(f"Redis set failed, falling back to memory: {e}")
+                logger.warning("Redis set failed, falling back to memory: %s", e)
                 self.redis = None
                 self.kv_ready = False
-        self.conversations[user_id] = msgs
-    def _clear_history(self, user_id):
+        now = time.monotonic()
+        with self._conv_lock:
+            self.conversations[user_id] = (now, msgs)
+            self.conversations.move_to_end(user_id)
+            # Least recently used first: drop the overflow and anything already expired
+            while self.conversations:
+                oldest_saved_at, _ = next(iter(self.conversations.values()))
+                if len(self.conversations) <= self.max_users and now - oldest_saved_at <= self.history_ttl:
+                    break
+                self.conversations.popitem(last=False)
+
+    # ---------------- Response cache ----------------
+    def _cache_key(self, kb, crop_key, qtype, query, history):
+        last_turn = next((m["content"] for m in reversed(history) if m.get("role") == "assistant"), "")
+        turn_hash = hashlib.sha1(last_turn.encode("utf-8")).hexdigest()[:16] if last_turn else ""
+        return (self.model, kb.version, crop_key, qtype, _canon(query), turn_hash)
+
+    def _build_semantic_cache(self):
+        if not SEMANTIC_CACHE_ENABLED:
+            return None
+        try:
+            cache = SemanticCache()
+            self._set_semantic_labels(cache, self.crop_data)
+            logger.info("✅ Semantic cache ready")
+            return cache
+        except Exception as e:
+            logger.warning("Semantic cache disabled: %s", e)
+            return None
+
+    def _set_semantic_labels(self, cache, crop_data):
+        """Crop / query-type descriptions for the embedding fallback in _classify()."""
+        crops = crop_data.get("crops", {})
+        cache.set_labels("crop", {
+            key: " ".join([info.get("name_hi", ""), info.get("name_mr", ""), *info.get("keywords", [])])
+            for key, info in crops.items()
+        })
+        cache.set_labels("qtype", {qtype: " ".join(sorted(kws)) for qtype, kws in QTYPE_KEYWORDS})
+
+    def _semantic_classify(self, query, crop_key, qtype):
+        """Fill a crop / qtype the keywords missed from the query embedding (reused by the cache lookup)."""
+        text = _canon(query)
+        try:
+            if crop_key is None:
+                crop_key = self.semantic_cache.classify("crop", text)
+            if qtype == "general":
+                qtype = self.semantic_cache.classify("qtype", text) or "general"
+        except Exception as e:
+            logger.warning("Semantic classification failed: %s", e)
+        return crop_key, qtype
+
+    def _semantic_get(self, key):
+        try:
+            return self.semantic_cache.get(key)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            return None
+
+    def _semantic_put(self, key, answer):
+        try:
+            self.semantic_cache.put(key, answer)
+        except Exception as e:
+            logger.warning("Semantic cache store failed: %s", e)
+
+    @staticmethod
+    def _redis_cache_key(key):
+        """Redis key for a response-cache tuple: the turn hash, then a digest of the rest."""
+        digest = hashlib.blake2b("\x1f".join(str(p or "") for p in key[:-1]).encode("utf-8"), digest_size=16).hexdigest()
+        return f"resp:{key[-1]}:{digest}"
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            answer = self.response_cache.get(key)
+            if answer:
+                self.response_cache.move_to_end(key)
+                return answer
         if self.redis:
-            self.redis.delete(self._conv_key(user_id))
-        else:
-            self.conversations.pop(user_id, None)
+            try:
+                answer = self.redis.get(self._redis_cache_key(key))
+            except Exception as e:
+                logger.warning("Redis cache get failed, falling back to memory: %s", e)
+                self.redis = None
+                self.kv_ready = False
+            if answer:
+                self._cache_put_local(key, answer)
+        # An empty string (left by older code) is a miss, not an answer
+        return answer or None
 
-    # ---------------- Public API ----------------
-    def get_response(self, user_id, query, max_retries=3, meta=None):
-        logger.info(f"User {user_id}: {query[:50]}...")
+    def _cache_put(self, key, answer, pipe=None):
+        self._cache_put_local(key, answer)
+        if pipe is not None:
+            pipe.setex(self._redis_cache_key(key), self.response_cache_ttl, answer)
+        elif self.redis:
+            try:
+                self.redis.setex(self._redis_cache_key(key), self.response_cache_ttl, answer)
+            except Exception as e:
+                logger.warning("Redis cache set failed, falling back to memory: %s", e)
+                self.redis = None
+                self.kv_ready = False
+
+    def _cache_put_local(self, key, answer):
+        with self._cache_lock:
+            self.response_cache[key] = answer
+            self.response_cache.move_to_end(key)
+            while len(self.response_cache) > self.response_cache_size:
+                self.response_cache.popitem(last=False)
+
+    def _cache_evict_user(self, history):
+        """
+        Drop local cached answers that were keyed on this user's latest conversation turn.
+        Redis copies are left to their TTL: after a clear the user's turn hash is empty,
+        so they can't be looked up for this user again (and may still serve others).
+        """
+        turn_hash = self._cache_key(self._kb, None, None, "", history)[-1]
+        if not turn_hash:
+            return
+        with self._cache_lock:
+            for key in [k for k in self.response_cache if k[-1] == turn_hash]:
+                del self.response_cache[key]
+
+    # ---------------- Turn helpers ----------------
+    def _prepare_turn(self, user_id, query, meta=None):
+        """
+        Build everything needed before the LLM call.
+        Returns (history, messages, cache_key, cached_answer); messages is None on a cache hit.
+        """
+        self._maybe_reload_kb()
+        kb = self._kb  # one KB for the whole turn, even if a reload lands meanwhile
         history = self._get_history(user_id)
 
+        detected_crop, qtype = self._classify(query, kb)
+        if self.semantic_cache and (detected_crop is None or qtype == "general"):
+            detected_crop, qtype = self._semantic_classify(query, detected_crop, qtype)
+
         # --- Stage text (optional) ---
         stage_text = ""
         if meta and isinstance(meta, dict):
@@ -315,10 +1074,8 @@ class KrishiGPT:
             sowing_date = meta.get("sowing_date")
             stage_info = self._get_stage_info(crop_key, sowing_date)
             # fallback: detect crop from query if not provided
-            if not stage_info and sowing_date:
-                detected_crop, _ = self._detect_crop(query)
-                if detected_crop:
-                    stage_info = self._get_stage_info(detected_crop, sowing_date)
+            if not stage_info and sowing_date and detected_crop:
+                stage_info = self._get_stage_info(detected_crop, sowing_date)
             if stage_info:
                 stage_text = (
                     f"\n\n--- 🌱 फसल की अवस्था ---\n"
@@ -326,47 +1083,188 @@ class KrishiGPT:
                     f"अवस्था: {stage_info['label']}."
                 )
 
-        crop_context = self._get_relevant_context(query)
-        enhanced_prompt = self.system_prompt
+        # --- Response caches (answers for a sowing date depend on today's date, never cached) ---
+        cache_key = None
+        if not stage_text and not (meta and isinstance(meta, dict) and meta.get("sowing_date")):
+            cache_key = self._cache_key(kb, detected_crop, qtype, query, history)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info("Response cache hit")
+                return history, None, cache_key, cached
+            if self.semantic_cache:
+                cached = self._semantic_get(cache_key)
+                if cached is not None:
+                    logger.info("Semantic cache hit")
+                    self._cache_put(cache_key, cached)
+                    return history, None, cache_key, cached
 
-        if stage_text:
-            enhanced_prompt += stage_text
+        crop_context = self._get_relevant_context(kb, detected_crop, qtype)
 
+        # Most stable first so the provider can reuse the longest prompt prefix:
+        # static system prompt, then the KB context (fixed per crop + qtype),
+        # then the date-dependent crop stage only when there is one.
+        messages = [{"role": "system", "content": self.system_prompt}]
         if crop_context:
-            enhanced_prompt += f"\n\n--- 📚 संबंधित जानकारी (Knowledge Base से) ---\n{crop_context}"
-            enhanced_prompt += "\n\n--- ⚠️ निर्देश ---\nऊपर दी गई जानकारी का उपयोग करके सुरक्षित, व्यावहारिक जवाब दो।"
+            messages.append({"role": "system", "content": (
+                f"--- 📚 संबंधित जानकारी (Knowledge Base से) ---\n{crop_context}"
+                "\n\n--- ⚠️ निर्देश ---\nऊपर दी गई जानकारी का उपयोग करके सुरक्षित, व्यावहारिक जवाब दो।"
+            )})
+        if stage_text:
+            messages.append({"role": "system", "content": stage_text.lstrip("\n")})
 
-        messages = [{"role": "system", "content": enhanced_prompt}]
-        messages.extend(history[-20:])  # last 20 messages
+        messages.extend(_trim_history(history))  # stored history itself stays capped at HISTORY_MAX_MESSAGES
         messages.append({"role": "user", "content": query})
+        return history, messages, cache_key, None
+
+    def _commit_turn(self, user_id, history, query, answer, cache_key=None):
+        """
+        Store a finished answer in the response cache and the user's history.
+        With Redis, the cache entry, history and per-user turn counter go out
+        in one pipelined round-trip.
+        """
+        pipe = self.redis.pipeline(transaction=False) if self.redis else None
+        if cache_key is not None:
+            self._cache_put(cache_key, answer, pipe)
+            if self.semantic_cache:
+                self._semantic_put(cache_key, answer)
+        history.append({"role": "user", "content": query})
+        history.append({"role": "assistant", "content": answer})
+        self._set_history(user_id, history, pipe)
+        if pipe is None:
+            return
+        stats_key = f"stats:user:{user_id}"
+        pipe.incr(stats_key)
+        pipe.expire(stats_key, self.history_ttl)
+        try:
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Redis pipeline failed, falling back to memory: %s", e)
+            self.redis = None
+            self.kv_ready = False
+            self._set_history(user_id, history)
+
+    # ---------------- Public API ----------------
+    def get_response(self, user_id, query, max_retries=3, meta=None, max_chars=None):
+        """
+        Whole answer as one string. Threads asking an identical question at the
+        same time (same cache key) wait for the first one's Groq call and then
+        take its answer from the response cache instead of making their own.
+        """
+        logger.info("User %s: %.50s...", user_id, query)
+        history, messages, cache_key, cached = self._prepare_turn(user_id, query, meta)
+        if cached is None and cache_key is not None:
+            with self._sync_inflight_lock:
+                leader = self._sync_inflight.get(cache_key)
+                if leader is None:
+                    done = self._sync_inflight[cache_key] = threading.Event()
+            if leader is None:
+                try:
+                    return "".join(self._stream_turn(user_id, query, history, messages,
+                                                     cache_key, max_retries, max_chars))
+                finally:
+                    with self._sync_inflight_lock:
+                        self._sync_inflight.pop(cache_key, None)
+                    done.set()
+            leader.wait(GROQ_TIMEOUT.read)
+            cached = self._cache_get(cache_key)
+
+        if cached is not None:
+            self._commit_turn(user_id, history, query, cached)
+            return cached
+        # No shareable answer (caching skipped, or the leader failed / was cut short)
+        return "".join(self._stream_turn(user_id, query, history, messages,
+                                         cache_key, max_retries, max_chars))
 
+    def get_response_stream(self, user_id, query, max_retries=3, meta=None, max_chars=None):
+        """
+        Generator yielding the answer in chunks as Groq streams it.
+        History and cache are updated once the stream completes.
+        With max_chars, generation is cut off as soon as the answer grows past
+        it (callers with a hard length limit); a cut answer is not cached.
+        """
+        logger.info("User %s: %.50s...", user_id, query)
+        history, messages, cache_key, cached = self._prepare_turn(user_id, query, meta)
+        if cached is not None:
+            self._commit_turn(user_id, history, query, cached)
+            yield cached
+            return
+        yield from self._stream_turn(user_id, query, history, messages, cache_key, max_retries, max_chars)
+
+    def _stream_turn(self, user_id, query, history, messages, cache_key, max_retries, max_chars):
+        """Stream one Groq completion for a prepared turn, then commit it."""
+        reselected = False
         for attempt in range(max_retries):
+            parts = []
+            length = 0
             try:
                 t0 = time.time()
-                response = self.client.chat.completions.create(
+                stream = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=0.7,
                     max_tokens=1000,
-                    top_p=0.9
+                    top_p=0.9,
+                    stream=True
                 )
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        if not parts:
+                            logger.info("First token in %.2fs", time.time() - t0)
+                        parts.append(delta)
+                        yield delta
+                        length += len(delta)
+                        if max_chars is not None and length > max_chars:
+                            stream.close()
+                            cache_key = None
+                            break
                 dt = time.time() - t0
-                logger.info(f"Response generated in {dt:.2f}s")
+                if not parts:
+                    # Nothing to keep: an empty answer must not reach the history or the cache
+                    logger.warning("Empty completion after %.2fs", dt)
+                    yield FALLBACK_REPLY
+                    return
+                logger.info("Response generated in %.2fs", dt)
 
-                ai_response = response.choices[0].message.content
+                self._commit_turn(user_id, history, query, "".join(parts), cache_key)
+                return
+            except Exception as e:
+                logger.error("Attempt %d failed: %s", attempt + 1, e)
+                if parts:
+                    # Part of the answer already reached the caller; a retry would repeat it
+                    yield "\n\n" + FALLBACK_REPLY
+                    return
+                if not reselected and self._reselect_model(e):
+                    reselected = True
+                    continue
+                delay = _retry_delay(e, attempt)
+                if delay is None or attempt == max_retries - 1:
+                    yield FALLBACK_REPLY
+                    return
+                time.sleep(delay)
+        # Retries used up without an answer (e.g. a model switch on the last attempt)
+        yield FALLBACK_REPLY
 
-                history.append({"role": "user", "content": query})
-                history.append({"role": "assistant", "content": ai_response})
-                self._set_history(user_id, history)
+    def warm_up(self):
+        """
+        Pay first-request costs at boot: open the pooled Groq connection with a
+        models list call (no tokens spent), load the tokenizer and, when the
+        semantic cache is on, run the embedding model once.
+        """
+        t0 = time.time()
+        try:
+            self._available_models()
+            _count_tokens(self.system_prompt)
+            if self.semantic_cache:
+                self.semantic_cache._embed("नमस्कार")
+            logger.info("Warm-up done in %.2fs", time.time() - t0)
+        except Exception as e:
+            logger.warning("Warm-up failed: %s", e)
 
-                return ai_response
-            except Exception as e:
-                logger.error(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(1)
-                else:
-                    return ("❌ माफ करें, तकनीकी समस्या है। कृपया थोड़ी देर बाद प्रयास करें। 🙏\n"
-                            "अगर समस्या बनी रहे तो किसान कॉल सेंटर पर कॉल करें: 1551")
+    def clear_history(self, user_id):
+        """Forget a user's conversation and any cached answers tied to it."""
+        self._cache_evict_user(self._get_history(user_id))
+        self._clear_history(user_id)
 
     def _clear_history(self, user_id):
         if self.redis:
@@ -374,30 +1272,44 @@ class KrishiGPT:
                 self.redis.delete(self._conv_key(user_id))
                 return
             except Exception as e:
-                logger.warning(f"Redis delete failed, falling back to memory: {e}")
+                logger.warning("Redis delete failed, falling back to memory: %s", e)
                 self.redis = None
                 self.kv_ready = False
-        self.conversations.pop(user_id, None)
+        with self._conv_lock:
+            self.conversations.pop(user_id, None)
+
+    def _build_quick_info(self, crop_data):
+        """Render the static quick-info answers (schemes, helplines) once from the KB."""
+        info = {}
+        schemes = crop_data.get("government_schemes", [])
+        if schemes:
+            parts = ["📋 **प्रमुख सरकारी योजनाएं:**\n\n"]
+            for scheme in schemes:
+                parts.append(
+                    f"🔹 **{scheme.get('name', '')}**\n"
+                    f"   {scheme.get('benefit', '')}\n"
+                    f"   आवेदन: {scheme.get('apply', '')}\n\n"
+                )
+            info["schemes"] = "".join(parts)
+        contacts = crop_data.get("emergency_contacts", {})
+        if contacts:
+            info["helpline"] = (
+                "📞 **महत्वपूर्ण हेल्पलाइन:**\n\n"
+                f"🌾 किसान कॉल सेंटर: {contacts.get('kisan_call_center', 'N/A')}\n"
+                f"🔬 कृषि विज्ञान केंद्र: {contacts.get('krishi_vigyan_kendra', 'N/A')}\n"
+                f"📱 PM-KISAN हेल्पलाइन: {contacts.get('pm_kisan_helpline', 'N/A')}\n"
+            )
+        return info
 
     def get_quick_info(self, topic):
         topic_lower = topic.lower()
+        quick_info = self._kb.quick_info
         if "योजना" in topic_lower or "scheme" in topic_lower:
-            schemes = self.crop_data.get("government_schemes", [])
-            if schemes:
-                result = "📋 **प्रमुख सरकारी योजनाएं:**\n\n"
-                for scheme in schemes:
-                    result += f"🔹 **{scheme.get('name', '')}**\n"
-                    result += f"   {scheme.get('benefit', '')}\n"
-                    result += f"   आवेदन: {scheme.get('apply', '')}\n\n"
-                return result
+            if "schemes" in quick_info:
+                return quick_info["schemes"]
         if "हेल्पलाइन" in topic_lower or "helpline" in topic_lower or "संपर्क" in topic_lower:
-            contacts = self.crop_data.get("emergency_contacts", {})
-            if contacts:
-                result = "📞 **महत्वपूर्ण हेल्पलाइन:**\n\n"
-                result += f"🌾 किसान कॉल सेंटर: {contacts.get('kisan_call_center', 'N/A')}\n"
-                result += f"🔬 कृषि विज्ञान केंद्र: {contacts.get('krishi_vigyan_kendra', 'N/A')}\n"
-                result += f"📱 PM-KISAN हेल्पलाइन: {contacts.get('pm_kisan_helpline', 'N/A')}\n"
-                return result
+            if "helpline" in quick_info:
+                return quick_info["helpline"]
         return None
 
 
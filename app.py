@@ -3,108 +3,304 @@
 # Optimized for Vercel Serverless Deployment
 
 import os
-import uuid
+import array
+import base64
+import hashlib
+import hmac
+import secrets
+import string
+import unicodedata
 import time
 import logging
-import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template, abort
+from flask import Flask, Response, request, jsonify, render_template, abort, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
 from ai_engine import KrishiGPT
-from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client as TwilioClient
-from twilio.request_validator import RequestValidator
 from voice_handler import process_voice_message
 from image_handler import process_crop_image 
-from schemes_data import get_scheme_by_name, get_all_schemes_summary, format_scheme_details, GOVERNMENT_SCHEMES
+from schemes_data import get_scheme_by_name, find_schemes, get_all_schemes_summary, format_scheme_details, GOVERNMENT_SCHEMES
 
-# Rate limiting (using in-memory storage for Vercel)
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from functools import wraps
+from xml.sax.saxutils import escape as xml_escape
+from urllib.parse import urlsplit
+
+try:
+    import ahocorasick  # pyahocorasick: one pass over the message for every trigger word
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # native JSON encoder for jsonify(); stdlib json is the fallback
+except ImportError:
+    orjson = None
+
+try:
+    from flask_compress import Compress  # br / gzip for JSON, TwiML and the web UI
+except ImportError:
+    Compress = None
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Settings read by request handlers, resolved once
+APP_VERSION = os.getenv("APP_VERSION", "1.0.0")
+API_SECRET = (os.getenv("API_SECRET") or "").strip()
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+GEMINI_READY = bool(os.getenv("GEMINI_API_KEY"))
+
+# LOG_LEVEL=WARNING in production drops the per-request INFO lines before they are formatted
+# (ai_engine has usually configured the root logger already; this covers standalone use)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format=("%(asctime)s - " if os.getenv("LOG_TIMESTAMPS", "1") == "1" else "")
+                    + "%(levelname)s - %(message)s")
 logger = logging.getLogger("krishigpt")
+# Werkzeug's per-request access line (dev server only; gunicorn has its own access log)
+logging.getLogger("werkzeug").setLevel(os.getenv("WERKZEUG_LOG_LEVEL", "WARNING").upper())
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify() / request.get_json() through orjson; UTF-8 out, so Devanagari is not \\u-escaped."""
+
+    _OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 
 app = Flask(__name__)
-app.config["SECRET_KEY"] = os.urandom(24)
+# Shared across workers when set; a per-process random key only suits local runs
+app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY") or os.urandom(24)
+if orjson:
+    app.json = OrjsonProvider(app)
+else:
+    app.json.ensure_ascii = False
+
+# Compression as middleware; SSE streams are left alone so deltas are not buffered
+if Compress and os.getenv("COMPRESS", "1") == "1":
+    app.config.update(
+        COMPRESS_MIMETYPES=["application/json", "application/xml", "text/xml", "text/html",
+                            "text/css", "application/javascript"],
+        COMPRESS_ALGORITHM=["br", "gzip"],
+        COMPRESS_MIN_SIZE=500,
+        COMPRESS_LEVEL=5,
+        COMPRESS_BR_LEVEL=5,
+        COMPRESS_STREAMS=False,
+    )
+    Compress(app)
+
+# ---------- Rate limiting ----------
+_RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def _parse_rate(spec):
+    """'10 per minute' / '10/minute' -> (tokens per second, burst)."""
+    count, _, period = spec.replace("/", " per ").partition(" per ")
+    count = int(count)
+    return count / _RATE_PERIODS[period.strip().rstrip("s")], count
+
+
+class TokenBucket:
+    """
+    In-process token buckets, one (tokens, last_refill, idle_after) entry per key.
+    Each gunicorn worker keeps its own buckets.
+    """
 
-# Limiter: use memory:// for Vercel (no Redis persistence needed)
-limiter = Limiter(
-    key_func=get_remote_address,
-    app=app,
-    storage_uri="memory://"
-)
+    def __init__(self, prune_interval=60.0):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.prune_interval = prune_interval
+        self._pruned_at = time.monotonic()
+
+    def allow(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._buckets.get(key)
+            tokens, last = (entry[0], entry[1]) if entry else (burst, now)
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            # idle_after: how long this key's bucket takes to refill completely
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now, burst / rate)
+            if now - self._pruned_at >= self.prune_interval:
+                self._prune(now)
+        return allowed
+
+    def _prune(self, now):
+        # Buckets idle long enough to be full again carry no state worth keeping;
+        # each is judged by its own route's rate / burst
+        self._pruned_at = now
+        for key in [k for k, (_, last, idle_after) in self._buckets.items() if now - last >= idle_after]:
+            del self._buckets[key]
+
+
+_rate_buckets = TokenBucket()
+
+
+class RedisFixedWindow:
+    """
+    Fixed-window counters in Redis, shared by every worker: one INCR (+ EXPIRE on the
+    first hit) per request, sent as a single script call.
+    """
+
+    _SCRIPT = ("local c = redis.call('INCR', KEYS[1]) "
+               "if c == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end "
+               "return c")
+
+    def __init__(self):
+        self._client = None
+        self._script = None
+
+    def allow(self, kv, key, rate, burst):
+        window = max(1, round(burst / rate))
+        if self._client is not kv:
+            self._script = kv.register_script(self._SCRIPT)
+            self._client = kv
+        name, who = key
+        count = self._script(keys=[f"rl:{name}:{who}:{int(time.time()) // window}"], args=[window])
+        return count <= burst
+
+
+# Limits are shared through Redis when the engine has it; the local buckets cover
+# runs without Redis and any Redis error
+RATE_LIMIT_REDIS = os.getenv("RATE_LIMIT_REDIS", "1") == "1"
+_rate_windows = RedisFixedWindow()
+
+
+def _rate_allow(key, rate, burst):
+    kv = krishigpt.redis if RATE_LIMIT_REDIS and krishigpt else None
+    if kv is not None:
+        try:
+            return _rate_windows.allow(kv, key, rate, burst)
+        except Exception as e:
+            logger.warning("Redis rate limit check failed, using local buckets: %s", e)
+    return _rate_buckets.allow(key, rate, burst)
+
+
+def get_remote_address():
+    return request.remote_addr or "127.0.0.1"
+
+
+def rate_limit(name, spec, key_func=get_remote_address):
+    """Route decorator: 429 once the caller's `name` bucket (spec like '10 per minute') is empty."""
+    rate, burst = _parse_rate(spec)
+
+    def decorator(f):
+        @wraps(f)
+        def _wrap(*args, **kwargs):
+            # Only the outermost limited view counts (chat_secure calls chat)
+            if not g.get("rate_limited"):
+                g.rate_limited = True
+                if not _rate_allow((name, key_func()), rate, burst):
+                    abort(429)
+            return f(*args, **kwargs)
+        return _wrap
+    return decorator
 
-print("\n" + "=" * 60)
-print("🌾 Starting KrishiGPT Web Server...")
-print("=" * 60 + "\n")
+
+CHAT_RATE = os.getenv("CHAT_RATE_PER_MIN", "10 per minute")
+CALC_RATE = os.getenv("CALC_RATE_PER_MIN", "60 per minute")
+
+logger.info("🌾 Starting KrishiGPT Web Server...")
+
+# Appended to every web chat answer
+CHAT_DISCLAIMER = "\n\n---\n⚠️ ही सामान्य सल्ला आहे; स्थानीय लेबल/नियम पहा. शंका असल्यास KVK/कृषी अधिकारी भेटा."
 
 # ---------- Metrics (In-memory for Vercel) ----------
 uptime_start = time.time()
-metrics_local = {}
+# Fixed counter set: call sites pass a slot index, the names are only needed for /metrics
+METRIC_NAMES = (
+    "chat_requests", "chat_success", "chat_errors",
+    "wa_inbound", "wa_success", "wa_errors", "wa_duplicates",
+    "calc_requests", "calc_success", "calc_errors",
+    "schemes_requests",
+)
+(M_CHAT_REQUESTS, M_CHAT_SUCCESS, M_CHAT_ERRORS,
+ M_WA_INBOUND, M_WA_SUCCESS, M_WA_ERRORS, M_WA_DUPLICATES,
+ M_CALC_REQUESTS, M_CALC_SUCCESS, M_CALC_ERRORS,
+ M_SCHEMES_REQUESTS) = range(len(METRIC_NAMES))
+_metric_counts = array.array("q", [0] * len(METRIC_NAMES))
+_metrics_lock = threading.Lock()
 
 
-def _metrics_inc(key, by=1):
+def _metrics_inc(slot, by=1):
     """Increment metric counter"""
-    metrics_local[key] = metrics_local.get(key, 0) + by
-
-
-def _metrics_get(key):
-    """Get metric value"""
-    return int(metrics_local.get(key, 0))
+    with _metrics_lock:
+        _metric_counts[slot] += by
 
 
 def _metrics_snapshot():
     """Get all metrics"""
-    keys = [
-        "chat_requests", "chat_success", "chat_errors",
-        "wa_inbound", "wa_success", "wa_errors",
-        "calc_requests", "calc_success", "calc_errors",
-        "schemes_requests"
-    ]
-    return {k: _metrics_get(k) for k in keys}
+    return dict(zip(METRIC_NAMES, _metric_counts))
 
 
 # Initialize AI
 krishigpt = None
 try:
     krishigpt = KrishiGPT()
-    print("✅ KrishiGPT AI Engine initialized successfully!\n")
+    logger.info("✅ KrishiGPT AI Engine initialized successfully!")
+    # Connection / model warm-up off the import path so the worker starts serving right away
+    if os.getenv("WARMUP", "1") == "1":
+        threading.Thread(target=krishigpt.warm_up, name="warm-up", daemon=True).start()
 except Exception as e:
-    print(f"❌ Failed to initialize KrishiGPT: {e}")
+    logger.error("❌ Failed to initialize KrishiGPT: %s", e)
     krishigpt = None
 
 # Twilio (optional)
 twilio_client = None
-twilio_validator = None
+twilio_signing_key = None  # auth token bytes for webhook signature checks
 try:
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    if account_sid and auth_token:
-        twilio_client = TwilioClient(account_sid, auth_token)
-        twilio_validator = RequestValidator(auth_token)
-        print("✅ Twilio client initialized\n")
+    if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        twilio_signing_key = TWILIO_AUTH_TOKEN.encode()
+        logger.info("✅ Twilio client initialized")
 except Exception as e:
-    print(f"⚠️ Twilio client not initialized: {e}\n")
+    logger.warning("⚠️ Twilio client not initialized: %s", e)
 
 # ---------- Helpers ----------
 
+def _new_user_id():
+    """Opaque session id for clients that did not send one (no UUID object needed)."""
+    return secrets.token_hex(8)
+
+
 def require_api_key(f):
     """Decorator to require API key for protected endpoints"""
     @wraps(f)
     def _wrap(*args, **kwargs):
-        expected = os.getenv("API_SECRET", "").strip()
-        if not expected:
+        if not API_SECRET:
             return f(*args, **kwargs)
         provided = request.headers.get("X-API-Key", "").strip()
-        if provided != expected:
+        if provided != API_SECRET:
             return jsonify({"success": False, "error": "unauthorized"}), 401
         return f(*args, **kwargs)
     return _wrap
 
 
+_DOSE_UNITS = frozenset(("ml_per_l", "g_per_l", "ml_per_acre", "g_per_acre"))
+_PER_LITER_UNITS = frozenset(("ml_per_l", "g_per_l"))
+
+
+def _round_amount(x):
+    """Round a dose for display: 3 decimals below 1, else 2."""
+    if x is None:
+        return None
+    x = float(x)
+    return round(x, 3 if x < 1 else 2)
+
+
 def _calc_dose(payload: dict):
     """
     Dosage calculator
@@ -116,17 +312,21 @@ def _calc_dose(payload: dict):
       - area_acre: float (default 1.0)
       - product: str (optional)
     """
-    unit = (payload.get("unit") or "").strip().lower()
+    unit = str(payload.get("unit") or "").strip().lower()
     rate = payload.get("rate", None)
-    tank_size = float(payload.get("tank_size_l", 0) or 0)
-    spray_vol = float(payload.get("spray_volume_l_per_acre", 0) or 0)
-    area = float(payload.get("area_acre", 1) or 1)
     product = payload.get("product")
 
-    if unit not in ["ml_per_l", "g_per_l", "ml_per_acre", "g_per_acre"]:
+    if unit not in _DOSE_UNITS:
         return None, "invalid unit. Use: ml_per_l, g_per_l, ml_per_acre, g_per_acre."
     if rate is None:
         return None, "rate is required."
+    try:
+        rate = float(rate)
+        tank_size = float(payload.get("tank_size_l", 0) or 0)
+        spray_vol = float(payload.get("spray_volume_l_per_acre", 0) or 0)
+        area = float(payload.get("area_acre", 1) or 1)
+    except (TypeError, ValueError):
+        return None, "rate, tank_size_l, spray_volume_l_per_acre and area_acre must be numbers."
 
     amt_unit = "ml" if unit.startswith("ml_") else "g"
 
@@ -137,8 +337,8 @@ def _calc_dose(payload: dict):
     total_water = None
     tanks_needed = None
 
-    if unit in ["ml_per_l", "g_per_l"]:
-        per_liter = float(rate)
+    if unit in _PER_LITER_UNITS:
+        per_liter = rate
         if tank_size > 0:
             per_tank = per_liter * tank_size
         if spray_vol > 0:
@@ -148,7 +348,7 @@ def _calc_dose(payload: dict):
             if tank_size > 0:
                 tanks_needed = total_water / tank_size
     else:
-        per_acre = float(rate)
+        per_acre = rate
         if spray_vol <= 0:
             total_area_amt = per_acre * area
         else:
@@ -159,27 +359,22 @@ def _calc_dose(payload: dict):
                 per_tank = per_acre * (tank_size / spray_vol)
                 tanks_needed = total_water / tank_size
 
-    def r(x):
-        if x is None:
-            return None
-        return round(float(x), 3 if float(x) < 1 else 2)
-
     result = {
         "input": {
             "product": product,
             "unit": unit,
-            "rate": float(rate),
+            "rate": rate,
             "tank_size_l": tank_size or None,
             "spray_volume_l_per_acre": spray_vol or None,
             "area_acre": area,
         },
         "results": {
-            "per_liter": {"amount": r(per_liter), "unit": amt_unit} if per_liter is not None else None,
-            "per_tank": {"amount": r(per_tank), "unit": amt_unit} if per_tank is not None else None,
-            "per_acre": {"amount": r(per_acre), "unit": amt_unit} if per_acre is not None else None,
-            "area_total": {"amount": r(total_area_amt), "unit": amt_unit, "area_acre": area} if total_area_amt is not None else None,
-            "total_water_l": r(total_water),
-            "tanks_needed": r(tanks_needed)
+            "per_liter": {"amount": _round_amount(per_liter), "unit": amt_unit} if per_liter is not None else None,
+            "per_tank": {"amount": _round_amount(per_tank), "unit": amt_unit} if per_tank is not None else None,
+            "per_acre": {"amount": _round_amount(per_acre), "unit": amt_unit} if per_acre is not None else None,
+            "area_total": {"amount": _round_amount(total_area_amt), "unit": amt_unit, "area_acre": area} if total_area_amt is not None else None,
+            "total_water_l": _round_amount(total_water),
+            "tanks_needed": _round_amount(tanks_needed)
         },
         "notes": [
             "Always follow product label and local regulations.",
@@ -200,32 +395,30 @@ def home():
         return jsonify({"service": "KrishiGPT", "message": "Web UI template missing"}), 200
 
 
-@app.route("/health")
-def health():
-    """Health check endpoint"""
-    return jsonify({
-        "status": "healthy",
-        "service": "KrishiGPT",
-        "version": os.getenv("APP_VERSION", "1.0.0"),
-        "ai_ready": bool(krishigpt is not None and getattr(krishigpt, "ai_ready", True)),
-        "whatsapp_ready": twilio_client is not None
-    })
+# Health never changes after startup, so the body is serialized once
+HEALTH_BODY = app.json.dumps({
+    "status": "healthy",
+    "service": "KrishiGPT",
+    "version": APP_VERSION,
+    "ai_ready": bool(krishigpt is not None and getattr(krishigpt, "ai_ready", True)),
+    "whatsapp_ready": twilio_client is not None
+}).encode()
 
 
-@app.route("/healthz")
-def healthz():
-    """Health check alias"""
-    return health()
+@app.route("/health")
+@app.route("/healthz", endpoint="healthz")
+def health():
+    """Health check endpoint (also served as /healthz)"""
+    return Response(HEALTH_BODY, mimetype="application/json")
 
 
 # ---------- Metrics route ----------
 @app.get("/metrics")
 def metrics():
     """Get usage metrics"""
-    token_cfg = os.getenv("METRICS_TOKEN")
-    if token_cfg:
+    if METRICS_TOKEN:
         token = request.headers.get("X-Metrics-Token") or request.args.get("token")
-        if token != token_cfg:
+        if token != METRICS_TOKEN:
             return jsonify({"error": "unauthorized"}), 401
 
     data = _metrics_snapshot()
@@ -237,177 +430,257 @@ def metrics():
 
 
 # ---------- Chat API ----------
-@limiter.limit(os.getenv("CHAT_RATE_PER_MIN", "10 per minute"))
-@app.route("/api/chat", methods=["POST"])
-def chat():
-    """Main chat API endpoint"""
-    _metrics_inc("chat_requests")
 
-    if not krishigpt or not getattr(krishigpt, "ai_ready", True):
-        _metrics_inc("chat_errors")
-        return jsonify({"success": False, "error": "AI Engine not initialized"}), 503
+# Pre-serialized 400 bodies for malformed chat requests, keyed by the bad field
+_CHAT_STR_FIELDS = ("message", "user_id", "crop", "sowing_date")
+_CHAT_BAD_REQUEST = {
+    field: app.json.dumps({"success": False, "error": f"'{field}' must be a string"}).encode()
+    for field in _CHAT_STR_FIELDS
+}
+_CHAT_BAD_REQUEST[None] = app.json.dumps({"success": False, "error": "Message is required"}).encode()
 
-    data = request.get_json(silent=True) or {}
-    user_id = data.get("user_id") or str(uuid.uuid4())
-    message = (data.get("message") or "").strip()
-    
-    if not message:
-        _metrics_inc("chat_errors")
-        return jsonify({"success": False, "error": "Message is required"}), 400
+
+def _read_chat_request():
+    """
+    Validate a chat POST body in one pass.
+    Returns (user_id, message, meta, None), or (.., error_response) when malformed.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    for field in _CHAT_STR_FIELDS:
+        if not isinstance(data.get(field) or "", str):
+            return None, None, None, Response(_CHAT_BAD_REQUEST[field], 400, mimetype="application/json")
+
+    # Empty / missing messages are rejected before any copy is made
+    message = data.get("message")
+    if not message or not (message := message.strip()):
+        return None, None, None, Response(_CHAT_BAD_REQUEST[None], 400, mimetype="application/json")
 
     crop = data.get("crop")
     sowing_date = data.get("sowing_date")
-    meta = None
-    if crop or sowing_date:
-        meta = {"crop": crop, "sowing_date": sowing_date}
+    meta = {"crop": crop, "sowing_date": sowing_date} if crop or sowing_date else None
+    return data.get("user_id") or _new_user_id(), message, meta, None
+
+
+def _start_chat():
+    """
+    Shared preamble of the chat endpoints: count the request, check the engine, read the body.
+    Returns (user_id, message, meta, None), or (.., error_response) already counted as an error.
+    """
+    _metrics_inc(M_CHAT_REQUESTS)
+
+    if not krishigpt or not getattr(krishigpt, "ai_ready", True):
+        _metrics_inc(M_CHAT_ERRORS)
+        return None, None, None, (jsonify({"success": False, "error": "AI Engine not initialized"}), 503)
+
+    user_id, message, meta, error = _read_chat_request()
+    if error:
+        _metrics_inc(M_CHAT_ERRORS)
+    return user_id, message, meta, error
+
+
+@app.route("/api/chat", methods=["POST"], provide_automatic_options=False)
+@rate_limit("chat", CHAT_RATE)
+def chat():
+    """Main chat API endpoint"""
+    user_id, message, meta, error = _start_chat()
+    if error:
+        return error
 
     try:
-        logger.info(f"Web chat from {user_id}: {message[:80]}...")
+        logger.info("Web chat from %s: %.80s...", user_id, message)
         answer = krishigpt.get_response(user_id, message, meta=meta)
-        answer += "\n\n---\n⚠️ ही सामान्य सल्ला आहे; स्थानीय लेबल/नियम पहा. शंका असल्यास KVK/कृषी अधिकारी भेटा."
-        _metrics_inc("chat_success")
-        return jsonify({"success": True, "response": answer, "user_id": user_id})
+        _metrics_inc(M_CHAT_SUCCESS)
+        return jsonify({"success": True, "response": answer + CHAT_DISCLAIMER, "user_id": user_id})
     except Exception as e:
         logger.exception("Error in /api/chat")
-        _metrics_inc("chat_errors")
+        _metrics_inc(M_CHAT_ERRORS)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# The disclaimer closes every stream; its SSE event is encoded once
+CHAT_STREAM_DISCLAIMER_EVENT = f"data: {app.json.dumps({'delta': CHAT_DISCLAIMER})}\n\n"
+
+
+@app.route("/api/chat/stream", methods=["POST"], provide_automatic_options=False)
+@rate_limit("chat", CHAT_RATE)
+def chat_stream():
+    """
+    Streaming chat: same input as /api/chat, answered as Server-Sent Events.
+    Each `data:` line is {"delta": "..."}; a final `event: done` carries the user_id.
+    """
+    user_id, message, meta, error = _start_chat()
+    if error:
+        return error
+
+    def events():
+        # SSE comment: headers go out now, before the cache lookup / first Groq token
+        yield ": ok\n\n"
+        logger.info("Web chat (stream) from %s: %.80s...", user_id, message)
+        try:
+            for delta in krishigpt.get_response_stream(user_id, message, meta=meta):
+                yield f"data: {app.json.dumps({'delta': delta})}\n\n"
+            yield CHAT_STREAM_DISCLAIMER_EVENT
+            yield f"event: done\ndata: {app.json.dumps({'user_id': user_id})}\n\n"
+            _metrics_inc(M_CHAT_SUCCESS)
+        except Exception as e:
+            logger.exception("Error in /api/chat/stream")
+            _metrics_inc(M_CHAT_ERRORS)
+            yield f"event: error\ndata: {app.json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ---------- Secure Chat API ----------
+@app.route("/api/chat-secure", methods=["POST"], provide_automatic_options=False)
 @require_api_key
-@limiter.limit(os.getenv("CHAT_RATE_PER_MIN", "10 per minute"))
-@app.route("/api/chat-secure", methods=["POST"])
+@rate_limit("chat", CHAT_RATE)
 def chat_secure():
     """Secure chat API (requires API key)"""
     return chat()
 
 
 # ---------- Dosage Calculator ----------
-@limiter.limit(os.getenv("CALC_RATE_PER_MIN", "60 per minute"))
-@app.route("/api/calc/dose", methods=["POST"])
+@app.route("/api/calc/dose", methods=["POST"], provide_automatic_options=False)
+@rate_limit("calc", CALC_RATE)
 def calc_dose():
     """Dosage calculator endpoint"""
-    _metrics_inc("calc_requests")
-    try:
-        payload = request.get_json(silent=True) or {}
-        result, err = _calc_dose(payload)
-        if err:
-            _metrics_inc("calc_errors")
-            return jsonify({"success": False, "error": err}), 400
-
-        _metrics_inc("calc_success")
-        return jsonify({"success": True, "data": result})
-    except Exception as e:
-        logger.exception("Error in /api/calc/dose")
-        _metrics_inc("calc_errors")
-        return jsonify({"success": False, "error": str(e)}), 500
+    _metrics_inc(M_CALC_REQUESTS)
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        _metrics_inc(M_CALC_ERRORS)
+        return jsonify({"success": False, "error": "request body must be a JSON object."}), 400
+    result, err = _calc_dose(payload)
+    if err:
+        _metrics_inc(M_CALC_ERRORS)
+        return jsonify({"success": False, "error": err}), 400
+
+    _metrics_inc(M_CALC_SUCCESS)
+    return jsonify({"success": True, "data": result})
 
 
+@app.route("/api/calc/dose-secure", methods=["POST"], provide_automatic_options=False)
 @require_api_key
-@limiter.limit(os.getenv("CALC_RATE_PER_MIN", "60 per minute"))
-@app.route("/api/calc/dose-secure", methods=["POST"])
+@rate_limit("calc", CALC_RATE)
 def calc_dose_secure():
     """Secure dosage calculator"""
     return calc_dose()
 
 
+DOSE_BATCH_MAX = int(os.getenv("DOSE_BATCH_MAX", "50"))
+
+
+@app.route("/api/calc/dose/batch", methods=["POST"], provide_automatic_options=False)
+@rate_limit("calc", CALC_RATE)
+def calc_dose_batch():
+    """Dosage calculator for several products in one request"""
+    _metrics_inc(M_CALC_REQUESTS)
+    payload = request.get_json(silent=True)
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        _metrics_inc(M_CALC_ERRORS)
+        return jsonify({"success": False, "error": "items must be a non-empty list."}), 400
+    if len(items) > DOSE_BATCH_MAX:
+        _metrics_inc(M_CALC_ERRORS)
+        return jsonify({"success": False, "error": f"at most {DOSE_BATCH_MAX} items per batch."}), 400
+
+    results = []
+    for item in items:
+        if not isinstance(item, dict):
+            results.append({"success": False, "error": "each item must be an object."})
+            continue
+        result, err = _calc_dose(item)
+        results.append({"success": False, "error": err} if err else {"success": True, "data": result})
+
+    _metrics_inc(M_CALC_SUCCESS)
+    return jsonify({"success": True, "count": len(results), "results": results})
+
+
 # ---------- Government Schemes API ----------
 
+# Scheme data is static: the list and every detail body are serialized once
+SCHEMES_LIST_BODY = app.json.dumps({
+    "success": True,
+    "count": len(GOVERNMENT_SCHEMES),
+    "schemes": [{
+        "id": key,
+        "name": scheme["name"],
+        "short_name": scheme["short_name"],
+        "benefit": scheme["benefit"],
+        "helpline": scheme.get("helpline", "1551"),
+        "website": scheme.get("website", "")
+    } for key, scheme in GOVERNMENT_SCHEMES.items()]
+}).encode()
+SCHEME_DETAIL_BODIES = {
+    key: app.json.dumps({"success": True, "scheme": scheme}).encode()
+    for key, scheme in GOVERNMENT_SCHEMES.items()
+}
+SCHEME_NOT_FOUND_BODY = app.json.dumps({"success": False, "error": "Scheme not found"}).encode()
+
+
 @app.route("/api/schemes", methods=["GET"])
 def get_schemes_list():
     """Get list of all government schemes"""
-    _metrics_inc("schemes_requests")
-    try:
-        schemes_list = []
-        for key, scheme in GOVERNMENT_SCHEMES.items():
-            schemes_list.append({
-                "id": key,
-                "name": scheme["name"],
-                "short_name": scheme["short_name"],
-                "benefit": scheme["benefit"],
-                "helpline": scheme.get("helpline", "1551"),
-                "website": scheme.get("website", "")
-            })
-        
-        return jsonify({
-            "success": True,
-            "count": len(schemes_list),
-            "schemes": schemes_list
-        })
-    except Exception as e:
-        logger.exception("Error in /api/schemes")
-        return jsonify({"success": False, "error": str(e)}), 500
+    _metrics_inc(M_SCHEMES_REQUESTS)
+    return Response(SCHEMES_LIST_BODY, mimetype="application/json")
 
 
 @app.route("/api/schemes/<scheme_id>", methods=["GET"])
 def get_scheme_details(scheme_id):
     """Get detailed information about a specific scheme"""
-    _metrics_inc("schemes_requests")
-    try:
-        if scheme_id not in GOVERNMENT_SCHEMES:
-            return jsonify({"success": False, "error": "Scheme not found"}), 404
-        
-        return jsonify({
-            "success": True,
-            "scheme": GOVERNMENT_SCHEMES[scheme_id]
-        })
-    except Exception as e:
-        logger.exception("Error in /api/schemes/<id>")
-        return jsonify({"success": False, "error": str(e)}), 500
+    _metrics_inc(M_SCHEMES_REQUESTS)
+    body = SCHEME_DETAIL_BODIES.get(scheme_id)
+    if body is None:
+        return Response(SCHEME_NOT_FOUND_BODY, 404, mimetype="application/json")
+    return Response(body, mimetype="application/json")
 
 
 @app.route("/api/schemes/search", methods=["GET"])
 def search_schemes():
     """Search schemes by query"""
-    _metrics_inc("schemes_requests")
-    try:
-        query = request.args.get("q", "").strip()
-        
-        if not query:
-            return jsonify({"success": False, "error": "Query parameter 'q' is required"}), 400
-        
-        scheme = get_scheme_by_name(query)
-        
-        if scheme:
-            return jsonify({
-                "success": True,
-                "found": True,
-                "scheme": scheme
-            })
-        
-        results = []
-        query_lower = query.lower()
-        
-        for key, scheme in GOVERNMENT_SCHEMES.items():
-            if (query_lower in scheme["name"].lower() or 
-                query_lower in scheme["short_name"].lower() or
-                query_lower in scheme["benefit"].lower()):
-                results.append({
-                    "id": key,
-                    "name": scheme["name"],
-                    "short_name": scheme["short_name"],
-                    "benefit": scheme["benefit"]
-                })
-        
+    _metrics_inc(M_SCHEMES_REQUESTS)
+    query = request.args.get("q", "").strip()
+    
+    if not query:
+        return jsonify({"success": False, "error": "Query parameter 'q' is required"}), 400
+    
+    scheme = get_scheme_by_name(query)
+    
+    if scheme:
         return jsonify({
             "success": True,
-            "found": len(results) > 0,
-            "count": len(results),
-            "results": results
+            "found": True,
+            "scheme": scheme
         })
-    except Exception as e:
-        logger.exception("Error in /api/schemes/search")
-        return jsonify({"success": False, "error": str(e)}), 500
+    
+    results = [{
+        "id": key,
+        "name": scheme["name"],
+        "short_name": scheme["short_name"],
+        "benefit": scheme["benefit"]
+    } for key, scheme in find_schemes(query)]
+    
+    return jsonify({
+        "success": True,
+        "found": len(results) > 0,
+        "count": len(results),
+        "results": results
+    })
 
 
 # ---------- Quick Info & History ----------
 
-@app.route("/api/clear-history", methods=["POST"])
+@app.route("/api/clear-history", methods=["POST"], provide_automatic_options=False)
 def clear_history():
     """Clear conversation history"""
-    data = request.get_json(silent=True) or {}
-    user_id = data.get("user_id", "")
-    if krishigpt and user_id:
+    data = request.get_json(silent=True)
+    user_id = data.get("user_id") if isinstance(data, dict) else None
+    if krishigpt and user_id and isinstance(user_id, str):
         krishigpt.clear_history(user_id)
     return jsonify({"success": True, "message": "History cleared"})
 
@@ -417,225 +690,559 @@ def quick_info(topic):
     """Get quick information on topic"""
     if not krishigpt or not getattr(krishigpt, "ai_ready", True):
         return jsonify({"success": False, "error": "AI not ready"}), 503
-    try:
-        info = krishigpt.get_quick_info(topic)
-        if info:
-            return jsonify({"success": True, "info": info})
-        return jsonify({"success": False, "error": "Topic not found"}), 404
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+    info = krishigpt.get_quick_info(topic)
+    if info:
+        return jsonify({"success": True, "info": info})
+    return jsonify({"success": False, "error": "Topic not found"}), 404
 
 
 # ---------- WhatsApp Webhook ----------
-@app.route("/whatsapp/webhook", methods=["GET", "POST"])
+WA_GREETINGS = frozenset({"hi", "hello", "start", "शुरू", "सुरू", "नमस्कार", "हेलो", "menu", "help", "मदत"})
+WA_RESETS = frozenset({"clear", "reset", "नवीन", "नया", "new"})
+WA_HELPLINE_WORDS = frozenset({"helpline", "हेल्पलाइन", "contact", "संपर्क"})
+WA_SCHEME_WORDS = frozenset({"योजना", "scheme", "schemes", "yojana"})
+
+
+# Same document MessagingResponse().message().body(text) produces, without the XML tree
+_TWIML_MESSAGE = '<?xml version="1.0" encoding="UTF-8"?><Response><Message><Body>{}</Body></Message></Response>'
+
+
+def _render_twiml(body):
+    """UTF-8 TwiML bytes for a single reply message."""
+    return _TWIML_MESSAGE.format(xml_escape(body)).encode()
+
+
+_TWIML_HEADERS = {"Content-Type": "application/xml"}
+
+
+def _twiml(twiml):
+    """Webhook return value for a rendered TwiML document."""
+    return twiml, 200, _TWIML_HEADERS
+
+
+# ProfileName stand-in when Twilio sends none
+WA_DEFAULT_SENDER_NAME = "शेतकरी"
+
+WA_WELCOME_TEXT = """🌾 KrishiGPT मध्ये स्वागत आहे, {sender_name}! 🙏
+
+मी तुमचा AI कृषी सल्लागार आहे.
+
+*कसे विचाराल:*
+✍️ टाइप करा - मराठी/हिंदीत
+🎤 आवाज पाठवा - Voice note!
+📷 फोटो पाठवा - रोग ओळखा!
+
+उदाहरण: "टोमॅटोची पाने पिवळी आहेत"
+
+💬 आता प्रश्न विचारा! 👇"""
+
+WA_HELPLINE_TEXT = """📞 महत्त्वाचे हेल्पलाइन:
+
+🌾 शेतकरी कॉल सेंटर: 1551
+📱 PM-KISAN: 155261
+🔬 KVK: kvk.icar.gov.in"""
+
+WA_RESET_TEXT = "✅ संवाद साफ झाला.\n\n🔄 नवीन प्रश्न विचारा!"
+
+# Rendered once at import; only the welcome needs the sender's name filled in
+WA_WELCOME_TWIML = _render_twiml(WA_WELCOME_TEXT)
+WA_RESET_TWIML = _render_twiml(WA_RESET_TEXT)
+WA_HELPLINE_TWIML = _render_twiml(WA_HELPLINE_TEXT)
+WA_SCHEMES_TEXT = get_all_schemes_summary()
+WA_SCHEMES_TWIML = _render_twiml(WA_SCHEMES_TEXT)
+
+
+def _wa_welcome(sender, sender_name):
+    return WA_WELCOME_TWIML.replace(b"{sender_name}", xml_escape(sender_name).encode())
+
+
+def _wa_reset(sender, sender_name):
+    krishigpt.clear_history(sender)
+    return WA_RESET_TWIML
+
+
+def _wa_helpline(sender, sender_name):
+    return WA_HELPLINE_TWIML
+
+
+def _wa_schemes(sender, sender_name):
+    return WA_SCHEMES_TWIML
+
+
+# Plain-text bodies of the commands, for replies sent through the REST API
+WA_COMMAND_TEXTS = {
+    _wa_welcome: WA_WELCOME_TEXT,
+    _wa_reset: WA_RESET_TEXT,
+    _wa_helpline: WA_HELPLINE_TEXT,
+    _wa_schemes: WA_SCHEMES_TEXT,
+}
+
+
+def _wa_command_text(command, sender, sender_name):
+    """Run a matched command (reset clears history) and return its reply as plain text."""
+    command(sender, sender_name)
+    return WA_COMMAND_TEXTS[command].replace("{sender_name}", sender_name)
+
+
+def _wa_normalize(text):
+    """Matching form of a message: NFC (precomposed Devanagari) and casefolded."""
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+# Normalized trigger word -> TwiML builder(sender, sender_name)
+WA_COMMANDS = {
+    _wa_normalize(trigger): handler
+    for triggers, handler in (
+        (WA_GREETINGS, _wa_welcome),
+        (WA_RESETS, _wa_reset),
+        (WA_HELPLINE_WORDS, _wa_helpline),
+        (WA_SCHEME_WORDS, _wa_schemes),
+    )
+    for trigger in triggers
+}
+
+_WA_SEPARATOR_CHARS = string.punctuation + string.whitespace + "।॥"
+_WA_SEPARATORS = frozenset(_WA_SEPARATOR_CHARS)
+
+# Only helpline words are also honoured inside short messages ("please send helpline").
+# Greeting / reset / scheme words appear in real questions ("नया बीज कौनसा",
+# "pm kisan yojana"), so those commands need the whole message.
+WA_TRIGGER_MAX_WORDS = int(os.getenv("WA_TRIGGER_MAX_WORDS", "3"))
+WA_PHRASE_COMMANDS = {_wa_normalize(trigger): _wa_helpline for trigger in WA_HELPLINE_WORDS}
+
+
+def _build_trigger_automaton():
+    """Aho-Corasick automaton over the WA_PHRASE_COMMANDS triggers; None without pyahocorasick."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for trigger, handler in WA_PHRASE_COMMANDS.items():
+        automaton.add_word(trigger, (len(trigger), handler))
+    automaton.make_automaton()
+    return automaton
+
+
+_wa_trigger_ac = _build_trigger_automaton()
+
+
+def _wa_match_command(lower):
+    """Handler when the whole _wa_normalize()d message (punctuation aside) is a trigger, else None."""
+    return WA_COMMANDS.get(lower.strip(_WA_SEPARATOR_CHARS))
+
+
+def _wa_match_phrase_command(lower):
+    """Handler for a whole-word helpline trigger inside a short message, else None."""
+    if not lower or len(lower.split()) > WA_TRIGGER_MAX_WORDS:
+        return None
+
+    if _wa_trigger_ac is None:
+        for token in lower.split():
+            handler = WA_PHRASE_COMMANDS.get(token.strip(_WA_SEPARATOR_CHARS))
+            if handler:
+                return handler
+        return None
+
+    for end, (length, handler) in _wa_trigger_ac.iter(lower):
+        start = end - length + 1
+        if (start == 0 or lower[start - 1] in _WA_SEPARATORS) and \
+                (end + 1 == len(lower) or lower[end + 1] in _WA_SEPARATORS):
+            return handler
+    return None
+
+
+# Background replies: a small pool sends answers through the Twilio REST API;
+# the slots bound running + queued jobs so bursts are shed instead of piling up
+WA_ASYNC_REPLIES = os.getenv("WA_ASYNC_REPLIES", "1") == "1"
+WA_REPLY_WORKERS = int(os.getenv("WA_REPLY_WORKERS", "8"))
+_wa_executor = ThreadPoolExecutor(max_workers=WA_REPLY_WORKERS, thread_name_prefix="wa-reply")
+_wa_slots = threading.BoundedSemaphore(WA_REPLY_WORKERS + int(os.getenv("WA_REPLY_QUEUE", "64")))
+# Voice / image jobs (media download + Whisper / Gemini) get their own pool so a
+# burst of photos cannot hold up plain text answers; they share the slots above
+WA_MEDIA_WORKERS = int(os.getenv("WA_MEDIA_WORKERS", "8"))
+_wa_media_executor = ThreadPoolExecutor(max_workers=WA_MEDIA_WORKERS, thread_name_prefix="wa-media")
+# WA_REPLY_BACKEND=redis: the webhook only pushes jobs onto a Redis list and worker.py
+# (a separate process) delivers them. For hosts that freeze a function once its
+# response is sent (Vercel), where background threads would never finish.
+WA_REPLY_BACKEND = os.getenv("WA_REPLY_BACKEND", "thread").lower()
+WA_QUEUE_KEY = os.getenv("WA_QUEUE_KEY", "wa:jobs")
+
+WA_EMPTY_TWIML = b'<?xml version="1.0" encoding="UTF-8"?><Response />'
+WA_BUSY_TWIML = _render_twiml("⏳ सध्या खूप प्रश्न येत आहेत. कृपया थोड्या वेळाने पुन्हा विचारा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
+
+# WhatsApp caps a message at 1600 chars; leave room for the voice echo and footer
+WA_ANSWER_MAX_CHARS = 1400
+WA_ANSWER_CUT_CHARS = 1350
+WA_MORE_SUFFIX = "\n\n... (अधिक माहितीसाठी वेबसाइट पहा)"
+WA_FOOTER = "\n\n---\n📞 शेतकरी हेल्पलाइन: 1551"
+WA_IMAGE_HEADER = "📷 *फोटो विश्लेषण:*\n\n"
+WA_IMAGE_FOOTER = "\n\n---\n⚠️ ही AI सल्ला आहे. गंभीर समस्येत KVK भेटा.\n📞 शेतकरी हेल्पलाइन: 1551"
+
+# Fixed replies for the media / error branches, rendered once like the commands above
+WA_AI_DOWN_TWIML = _render_twiml("❌ सर्व्हरमध्ये तांत्रिक समस्या आहे. कृपया 5 मिनिटांनी पुन्हा प्रयत्न करा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
+WA_VOICE_UNCONFIGURED_TWIML = _render_twiml("❌ व्हॉइस प्रोसेसिंग कॉन्फिगर नाही. कृपया टेक्स्टमध्ये लिहा.")
+WA_VOICE_UNCLEAR_TEXT = "❌ आवाज समजला नाही. कृपया पुन्हा प्रयत्न करा किंवा टेक्स्टमध्ये लिहा."
+WA_VOICE_ERROR_TEXT = "❌ आवाज प्रोसेस करताना समस्या. कृपया टेक्स्टमध्ये लिहा.\n\n📞 शेतकरी हेल्पलाइन: 1551"
+WA_VOICE_UNCLEAR_TWIML = _render_twiml(WA_VOICE_UNCLEAR_TEXT)
+WA_VOICE_ERROR_TWIML = _render_twiml(WA_VOICE_ERROR_TEXT)
+WA_VOICE_RECEIVED_TWIML = _render_twiml("🎤 आवाज मिळाला! उत्तर तयार करत आहोत…")
+WA_IMAGE_UNCONFIGURED_TWIML = _render_twiml("❌ इमेज प्रोसेसिंग कॉन्फिगर नाही. कृपया टेक्स्टमध्ये लिहा.")
+WA_IMAGE_PENDING_TWIML = _render_twiml("📷 फोटो मिळाला! फोटोवरून रोग ओळख लवकरच येत आहे.\n\nआत्तासाठी तुमची समस्या टेक्स्टमध्ये लिहा.")
+WA_IMAGE_UNCLEAR_TEXT = "❌ फोटोचे विश्लेषण होऊ शकले नाही. कृपया स्पष्ट फोटो पुन्हा पाठवा."
+WA_IMAGE_ERROR_TEXT = "❌ फोटो प्रोसेस करताना समस्या. कृपया टेक्स्टमध्ये लिहा.\n\n📞 शेतकरी हेल्पलाइन: 1551"
+WA_IMAGE_UNCLEAR_TWIML = _render_twiml(WA_IMAGE_UNCLEAR_TEXT)
+WA_IMAGE_ERROR_TWIML = _render_twiml(WA_IMAGE_ERROR_TEXT)
+WA_IMAGE_RECEIVED_TWIML = _render_twiml("📷 फोटो मिळाला! विश्लेषण करत आहोत…")
+WA_UNSUPPORTED_MEDIA_TWIML = _render_twiml("🙏 कृपया टेक्स्ट, आवाज (🎤) किंवा फोटो पाठवा.")
+WA_NO_QUESTION_TWIML = _render_twiml("🤔 प्रश्न मिळाला नाही.\n\n✍️ टाइप करा किंवा 🎤 आवाज पाठवा!")
+WA_ERROR_TWIML = _render_twiml("❌ तांत्रिक समस्या. कृपया पुन्हा प्रयत्न करा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
+
+
+def _wa_scheme_text(scheme):
+    details = format_scheme_details(scheme)
+    if len(details) > 1500:
+        details = details[:1450] + "\n\n..."
+    return details + WA_FOOTER
+
+
+# Scheme name -> rendered details reply
+WA_SCHEME_TWIML = {scheme["name"]: _render_twiml(_wa_scheme_text(scheme)) for scheme in GOVERNMENT_SCHEMES.values()}
+
+
+def _wa_answer(sender, incoming_msg, was_voice):
+    """AI answer for WhatsApp: length-capped, with the voice echo and helpline footer."""
+    # Generation stops just past the cap instead of producing text that is thrown away
+    ai_response = krishigpt.get_response(sender, incoming_msg, max_chars=WA_ANSWER_MAX_CHARS)
+
+    if len(ai_response) > WA_ANSWER_MAX_CHARS:
+        ai_response = ai_response[:WA_ANSWER_CUT_CHARS] + WA_MORE_SUFFIX
+
+    if was_voice:
+        return f"🎤 *तुम्ही विचारले:* \"{incoming_msg[:100]}\"\n\n{ai_response}{WA_FOOTER}"
+    return ai_response + WA_FOOTER
+
+
+def _wa_answer_and_send(sender, reply_from, incoming_msg, was_voice):
+    """Background job: generate the answer and deliver it as an outbound WhatsApp message."""
+    try:
+        body = _wa_answer(sender, incoming_msg, was_voice)
+        twilio_client.messages.create(from_=reply_from, to=sender, body=body)
+        logger.info("✅ Response sent to %s", sender[-10:])
+        _metrics_inc(M_WA_SUCCESS)
+    except Exception:
+        logger.exception("WhatsApp background reply failed")
+        _metrics_inc(M_WA_ERRORS)
+
+
+def _wa_voice_reply(sender, media_url, sender_name):
+    """Transcribe a voice note and answer it like a typed message; returns (body, ok)."""
+    result = process_voice_message(media_url, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    if not (result["success"] and result["text"]):
+        return WA_VOICE_UNCLEAR_TEXT, False
+    text = result["text"]
+    logger.info("🎤 Transcribed: %.100s...", text)
+    lower = _wa_normalize(text)
+    command = _wa_match_command(lower)
+    if command:
+        return _wa_command_text(command, sender, sender_name), True
+    scheme = get_scheme_by_name(text)
+    if scheme:
+        return _wa_scheme_text(scheme), True
+    command = _wa_match_phrase_command(lower)
+    if command:
+        return _wa_command_text(command, sender, sender_name), True
+    return _wa_answer(sender, text, True), True
+
+
+def _wa_image_reply(media_url):
+    """Diagnose a crop photo; returns (body, ok)."""
+    result = process_crop_image(media_url, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    if not (result["success"] and result["diagnosis"]):
+        return WA_IMAGE_UNCLEAR_TEXT, False
+    diagnosis = result["diagnosis"]
+    if len(diagnosis) > WA_ANSWER_MAX_CHARS:
+        diagnosis = diagnosis[:WA_ANSWER_CUT_CHARS] + WA_MORE_SUFFIX
+    return "".join((WA_IMAGE_HEADER, diagnosis, WA_IMAGE_FOOTER)), True
+
+
+def _wa_media_and_send(sender, reply_from, reply_func, error_text, *args):
+    """Background job: process a voice note / photo and deliver the reply."""
+    try:
+        try:
+            body, ok = reply_func(*args)
+        except Exception:
+            logger.exception("WhatsApp media processing failed")
+            body, ok = error_text, False
+        twilio_client.messages.create(from_=reply_from, to=sender, body=body)
+        logger.info("✅ Media reply sent to %s", sender[-10:])
+        _metrics_inc(M_WA_SUCCESS if ok else M_WA_ERRORS)
+    except Exception:
+        logger.exception("WhatsApp background media reply failed")
+        _metrics_inc(M_WA_ERRORS)
+
+
+def _wa_run_job(job):
+    """Deliver one background reply; jobs are plain dicts so they can travel through Redis."""
+    kind, sender, reply_from = job["kind"], job["sender"], job["reply_from"]
+    if kind == "voice":
+        _wa_media_and_send(sender, reply_from, _wa_voice_reply, WA_VOICE_ERROR_TEXT,
+                           sender, job["media_url"], job.get("sender_name", WA_DEFAULT_SENDER_NAME))
+    elif kind == "image":
+        _wa_media_and_send(sender, reply_from, _wa_image_reply, WA_IMAGE_ERROR_TEXT, job["media_url"])
+    else:
+        _wa_answer_and_send(sender, reply_from, job["text"], job.get("was_voice", False))
+
+
+def _wa_run_local(job):
+    """Pool wrapper around _wa_run_job that frees the job's slot."""
+    try:
+        _wa_run_job(job)
+    finally:
+        _wa_slots.release()
+
+
+def _wa_start_local(job):
+    """Hand a job to the in-process pools; the caller already holds a _wa_slots slot."""
+    pool = _wa_executor if job["kind"] == "text" else _wa_media_executor
+    pool.submit(_wa_run_local, job)
+
+
+def _wa_submit(job, ack_twiml):
+    """Queue a background reply; Twilio gets `ack_twiml` (or the busy notice) right away."""
+    kv = krishigpt.redis if WA_REPLY_BACKEND == "redis" and krishigpt else None
+    if kv is not None:
+        try:
+            kv.lpush(WA_QUEUE_KEY, app.json.dumps(job))
+            return ack_twiml
+        except Exception as e:
+            logger.warning("WhatsApp queue push failed, answering in-process: %s", e)
+    if not _wa_slots.acquire(blocking=False):
+        _metrics_inc(M_WA_ERRORS)
+        return WA_BUSY_TWIML
+    _wa_start_local(job)
+    return ack_twiml
+
+
+# Twilio retries a webhook it thinks timed out; the MessageSid lets a retry be dropped
+# instead of answered twice. Redis (when the engine has it) covers all workers.
+WA_DEDUP_TTL = int(os.getenv("WA_DEDUP_TTL", "600"))
+WA_DEDUP_SIZE = 4096
+_wa_recent_sids = OrderedDict()
+_wa_sid_lock = threading.Lock()
+
+
+def _wa_is_duplicate(sid):
+    """Record a MessageSid; True if it had already been seen."""
+    if not sid:
+        return False
+    kv = krishigpt.redis if krishigpt else None
+    if kv:
+        try:
+            return not kv.set(f"wa:sid:{sid}", 1, nx=True, ex=WA_DEDUP_TTL)
+        except Exception as e:
+            logger.warning("Redis MessageSid check failed, using local set: %s", e)
+    with _wa_sid_lock:
+        if sid in _wa_recent_sids:
+            return True
+        _wa_recent_sids[sid] = None
+        if len(_wa_recent_sids) > WA_DEDUP_SIZE:
+            _wa_recent_sids.popitem(last=False)
+    return False
+
+
+def _twilio_signature(url, params):
+    mac = hmac.new(twilio_signing_key, (url + params).encode(), hashlib.sha1)
+    return base64.b64encode(mac.digest()).decode()
+
+
+def _twilio_signature_ok(url, form, signature):
+    """
+    Twilio's X-Twilio-Signature check (same scheme as twilio.RequestValidator):
+    base64 HMAC-SHA1 of the URL plus the sorted form fields. The URL as received
+    is tried first; only on a mismatch is the other port variant signed too.
+    """
+    params = "".join(key + value for key in sorted(form) for value in sorted(set(form.getlist(key))))
+    if hmac.compare_digest(_twilio_signature(url, params), signature):
+        return True
+    parts = urlsplit(url)
+    if parts.port:
+        netloc = parts.netloc.rsplit(":", 1)[0]
+    else:
+        netloc = f"{parts.netloc}:{443 if parts.scheme == 'https' else 80}"
+    return hmac.compare_digest(_twilio_signature(parts._replace(netloc=netloc).geturl(), params), signature)
+
+
+def _wa_sender_key():
+    """Rate-limit key for the webhook: the farmer's WhatsApp number, else the caller IP."""
+    return request.form.get("From") or get_remote_address()
+
+
+# Per-sender limit; applied inside the webhook once the signature proves From is Twilio's
+WA_RATE, WA_BURST = _parse_rate(os.getenv("WA_RATE_PER_MIN", "20 per minute"))
+WA_RATE_LIMITED_TWIML = _render_twiml("⏳ खूप जास्त संदेश आले. कृपया एका मिनिटानंतर पुन्हा विचारा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
+
+
+WA_WEBHOOK_STATUS_BODY = app.json.dumps({"status": "WhatsApp webhook is active", "service": "KrishiGPT"}).encode()
+
+
+@app.route("/whatsapp/webhook", methods=["GET"])
+def whatsapp_webhook_status():
+    """Webhook liveness check for the Twilio console"""
+    return Response(WA_WEBHOOK_STATUS_BODY, mimetype="application/json")
+
+
+@app.route("/whatsapp/webhook", methods=["POST"], provide_automatic_options=False)
 def whatsapp_webhook():
     """Twilio WhatsApp webhook handler"""
-    if request.method == "GET":
-        return jsonify({"status": "WhatsApp webhook is active", "service": "KrishiGPT"})
+    _metrics_inc(M_WA_INBOUND)
 
-    _metrics_inc("wa_inbound")
-
-    # Validate Twilio signature
-    if twilio_validator:
+    # Validate Twilio signature; unsigned requests are refused before the body is parsed
+    if twilio_signing_key:
         signature = request.headers.get("X-Twilio-Signature", "")
-        if not twilio_validator.validate(request.url, request.form, signature):
+        if not signature or not _twilio_signature_ok(request.url, request.form, signature):
             abort(403)
 
+    # Twilio posts every field form-encoded; read them straight from the form
+    form = request.form
+    if _wa_is_duplicate(form.get("MessageSid")):
+        _metrics_inc(M_WA_DUPLICATES)
+        return _twiml(WA_EMPTY_TWIML)
+
+    if not _rate_allow(("whatsapp", _wa_sender_key()), WA_RATE, WA_BURST):
+        abort(429)
+
     try:
-        incoming_msg = (request.values.get("Body") or "").strip()
-        sender = request.values.get("From", "")
-        sender_name = request.values.get("ProfileName", "शेतकरी")
+        incoming_msg = form.get("Body") or ""
+        if incoming_msg:
+            incoming_msg = incoming_msg.strip()
+        sender = form.get("From", "")
+        sender_name = form.get("ProfileName", WA_DEFAULT_SENDER_NAME)
         sender_short = sender.replace("whatsapp:", "")[-10:] if sender else "Unknown"
         
-        num_media = int(request.values.get("NumMedia", 0))
-
-        logger.info(f"📱 WhatsApp from {sender_short}: msg='{incoming_msg[:50]}...' media={num_media}")
+        num_media = int(form.get("NumMedia", 0))
+        media_type = form.get("MediaContentType0", "").lower() if num_media > 0 else ""
 
-        resp = MessagingResponse()
-        msg = resp.message()
+        logger.info("📱 WhatsApp from %s: msg='%.50s...' media=%s", sender_short, incoming_msg, num_media)
 
         if not krishigpt or not getattr(krishigpt, "ai_ready", True):
-            msg.body("❌ सर्व्हरमध्ये तांत्रिक समस्या आहे. कृपया 5 मिनिटांनी पुन्हा प्रयत्न करा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
-            _metrics_inc("wa_errors")
-            return str(resp), 200, {"Content-Type": "application/xml"}
+            _metrics_inc(M_WA_ERRORS)
+            return _twiml(WA_AI_DOWN_TWIML)
 
         # ========== VOICE MESSAGE HANDLING ==========
         if num_media > 0:
-            media_type = request.values.get("MediaContentType0", "")
-            media_url = request.values.get("MediaUrl0", "")
+            media_url = form.get("MediaUrl0", "")
             
-            logger.info(f"📎 Media received: type={media_type}")
+            logger.info("📎 Media received: type=%s", media_type)
             
-            if "audio" in media_type.lower() or "ogg" in media_type.lower():
+            if "audio" in media_type or "ogg" in media_type:
                 logger.info("🎤 Processing voice message...")
                 
                 try:
-                    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-                    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+                    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
+                        _metrics_inc(M_WA_ERRORS)
+                        return _twiml(WA_VOICE_UNCONFIGURED_TWIML)
+
+                    if WA_ASYNC_REPLIES and twilio_client:
+                        job = {"kind": "voice", "sender": sender, "reply_from": form.get("To", ""),
+                               "media_url": media_url, "sender_name": sender_name}
+                        twiml = _wa_submit(job, WA_VOICE_RECEIVED_TWIML)
+                        return _twiml(twiml)
                     
-                    if not account_sid or not auth_token:
-                        msg.body("❌ व्हॉइस प्रोसेसिंग कॉन्फिगर नाही. कृपया टेक्स्टमध्ये लिहा.")
-                        _metrics_inc("wa_errors")
-                        return str(resp), 200, {"Content-Type": "application/xml"}
-                    
-                    voice_result = process_voice_message(media_url, account_sid, auth_token)
+                    voice_result = process_voice_message(media_url, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
                     
                     if voice_result["success"] and voice_result["text"]:
                         transcribed_text = voice_result["text"]
-                        logger.info(f"🎤 Transcribed: {transcribed_text[:100]}...")
+                        logger.info("🎤 Transcribed: %.100s...", transcribed_text)
                         incoming_msg = transcribed_text
                     else:
-                        msg.body("❌ आवाज समजला नाही. कृपया पुन्हा प्रयत्न करा किंवा टेक्स्टमध्ये लिहा.")
-                        _metrics_inc("wa_errors")
-                        return str(resp), 200, {"Content-Type": "application/xml"}
+                        _metrics_inc(M_WA_ERRORS)
+                        return _twiml(WA_VOICE_UNCLEAR_TWIML)
                         
                 except Exception as e:
                     logger.exception("Voice processing error")
-                    msg.body("❌ आवाज प्रोसेस करताना समस्या. कृपया टेक्स्टमध्ये लिहा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
-                    _metrics_inc("wa_errors")
-                    return str(resp), 200, {"Content-Type": "application/xml"}
+                    _metrics_inc(M_WA_ERRORS)
+                    return _twiml(WA_VOICE_ERROR_TWIML)
             
             # Handle IMAGES
-            elif "image" in media_type.lower():
+            elif "image" in media_type:
                 logger.info("📷 Processing crop image...")
                 
                 try:
-                    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-                    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-                    
-                    if not account_sid or not auth_token:
-                        msg.body("❌ इमेज प्रोसेसिंग कॉन्फिगर नाही. कृपया टेक्स्टमध्ये लिहा.")
-                        _metrics_inc("wa_errors")
-                        return str(resp), 200, {"Content-Type": "application/xml"}
+                    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
+                        _metrics_inc(M_WA_ERRORS)
+                        return _twiml(WA_IMAGE_UNCONFIGURED_TWIML)
                     
-                    if not os.getenv("GEMINI_API_KEY"):
-                        msg.body("📷 फोटो मिळाला! फोटोवरून रोग ओळख लवकरच येत आहे.\n\nआत्तासाठी तुमची समस्या टेक्स्टमध्ये लिहा.")
-                        _metrics_inc("wa_success")
-                        return str(resp), 200, {"Content-Type": "application/xml"}
+                    if not GEMINI_READY:
+                        _metrics_inc(M_WA_SUCCESS)
+                        return _twiml(WA_IMAGE_PENDING_TWIML)
                     
-                    image_result = process_crop_image(media_url, account_sid, auth_token)
-                    
-                    if image_result["success"] and image_result["diagnosis"]:
-                        diagnosis = image_result["diagnosis"]
-                        
-                        if len(diagnosis) > 1400:
-                            diagnosis = diagnosis[:1350] + "\n\n... (अधिक माहितीसाठी वेबसाइट पहा)"
-                        
-                        response_text = f"""📷 *फोटो विश्लेषण:*
-
-{diagnosis}
-
----
-⚠️ ही AI सल्ला आहे. गंभीर समस्येत KVK भेटा.
-📞 शेतकरी हेल्पलाइन: 1551"""
-                        
-                        msg.body(response_text)
-                        logger.info(f"✅ Image diagnosis sent to {sender_short}")
-                        _metrics_inc("wa_success")
-                    else:
-                        msg.body("❌ फोटोचे विश्लेषण होऊ शकले नाही. कृपया स्पष्ट फोटो पुन्हा पाठवा.")
-                        _metrics_inc("wa_errors")
-                    
-                    return str(resp), 200, {"Content-Type": "application/xml"}
+                    if WA_ASYNC_REPLIES and twilio_client:
+                        job = {"kind": "image", "sender": sender, "reply_from": form.get("To", ""),
+                               "media_url": media_url}
+                        twiml = _wa_submit(job, WA_IMAGE_RECEIVED_TWIML)
+                        return _twiml(twiml)
+
+                    response_text, ok = _wa_image_reply(media_url)
+                    if ok:
+                        logger.info("✅ Image diagnosis sent to %s", sender_short)
+                        _metrics_inc(M_WA_SUCCESS)
+                        return _twiml(_render_twiml(response_text))
+
+                    _metrics_inc(M_WA_ERRORS)
+                    return _twiml(WA_IMAGE_UNCLEAR_TWIML)
                     
                 except Exception as e:
                     logger.exception("Image processing error")
-                    msg.body("❌ फोटो प्रोसेस करताना समस्या. कृपया टेक्स्टमध्ये लिहा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
-                    _metrics_inc("wa_errors")
-                    return str(resp), 200, {"Content-Type": "application/xml"}
+                    _metrics_inc(M_WA_ERRORS)
+                    return _twiml(WA_IMAGE_ERROR_TWIML)
             else:
-                msg.body("🙏 कृपया टेक्स्ट, आवाज (🎤) किंवा फोटो पाठवा.")
-                _metrics_inc("wa_success")
-                return str(resp), 200, {"Content-Type": "application/xml"}
+                _metrics_inc(M_WA_SUCCESS)
+                return _twiml(WA_UNSUPPORTED_MEDIA_TWIML)
 
-        lower = incoming_msg.lower()
+        lower = _wa_normalize(incoming_msg)
 
-        # Welcome
-        if lower in ["hi", "hello", "start", "शुरू", "सुरू", "नमस्कार", "हेलो", "menu", "help", "मदत"]:
-            welcome = f"""🌾 KrishiGPT मध्ये स्वागत आहे, {sender_name}! 🙏
-
-मी तुमचा AI कृषी सल्लागार आहे.
-
-*कसे विचाराल:*
-✍️ टाइप करा - मराठी/हिंदीत
-🎤 आवाज पाठवा - Voice note!
-📷 फोटो पाठवा - रोग ओळखा!
-
-उदाहरण: "टोमॅटोची पाने पिवळी आहेत"
-
-💬 आता प्रश्न विचारा! 👇"""
-            msg.body(welcome)
-            _metrics_inc("wa_success")
-            return str(resp), 200, {"Content-Type": "application/xml"}
-
-        # Reset
-        if lower in ["clear", "reset", "नवीन", "नया", "new"]:
-            krishigpt.clear_history(sender)
-            msg.body("✅ संवाद साफ झाला.\n\n🔄 नवीन प्रश्न विचारा!")
-            _metrics_inc("wa_success")
-            return str(resp), 200, {"Content-Type": "application/xml"}
-
-        # Helpline
-        if lower in ["helpline", "हेल्पलाइन", "contact", "संपर्क"]:
-            helpline = """📞 महत्त्वाचे हेल्पलाइन:
-
-🌾 शेतकरी कॉल सेंटर: 1551
-📱 PM-KISAN: 155261
-🔬 KVK: kvk.icar.gov.in"""
-            msg.body(helpline)
-            _metrics_inc("wa_success")
-            return str(resp), 200, {"Content-Type": "application/xml"}
-
-        # Schemes
-        if lower in ["योजना", "scheme", "schemes", "yojana"]:
-            scheme_msg = get_all_schemes_summary()
-            msg.body(scheme_msg)
-            _metrics_inc("wa_success")
-            return str(resp), 200, {"Content-Type": "application/xml"}
+        # Commands (whole message): helpline / schemes are pre-rendered; welcome / reset are per sender
+        command = _wa_match_command(lower)
+        if command:
+            _metrics_inc(M_WA_SUCCESS)
+            return _twiml(command(sender, sender_name))
         
         # Specific scheme
         scheme = get_scheme_by_name(incoming_msg)
         if scheme:
-            scheme_details = format_scheme_details(scheme)
-            if len(scheme_details) > 1500:
-                scheme_details = scheme_details[:1450] + "\n\n..."
-            scheme_details += "\n\n---\n📞 शेतकरी हेल्पलाइन: 1551"
-            msg.body(scheme_details)
-            _metrics_inc("wa_success")
-            return str(resp), 200, {"Content-Type": "application/xml"}
+            twiml = WA_SCHEME_TWIML.get(scheme["name"]) or _render_twiml(_wa_scheme_text(scheme))
+            _metrics_inc(M_WA_SUCCESS)
+            return _twiml(twiml)
+
+        # Short phrases that ask for the helpline ("helpline number please")
+        command = _wa_match_phrase_command(lower)
+        if command:
+            _metrics_inc(M_WA_SUCCESS)
+            return _twiml(command(sender, sender_name))
 
         # Empty
         if not incoming_msg:
-            msg.body("🤔 प्रश्न मिळाला नाही.\n\n✍️ टाइप करा किंवा 🎤 आवाज पाठवा!")
-            _metrics_inc("wa_success")
-            return str(resp), 200, {"Content-Type": "application/xml"}
+            _metrics_inc(M_WA_SUCCESS)
+            return _twiml(WA_NO_QUESTION_TWIML)
 
         # AI Response
-        logger.info("🤖 Generating AI response…")
-        
-        was_voice = num_media > 0 and "audio" in request.values.get("MediaContentType0", "").lower()
-        
-        ai_response = krishigpt.get_response(sender, incoming_msg)
-        
-        if len(ai_response) > 1400:
-            ai_response = ai_response[:1350] + "\n\n... (अधिक माहितीसाठी वेबसाइट पहा)"
-        
-        if was_voice:
-            ai_response = f"🎤 *तुम्ही विचारले:* \"{incoming_msg[:100]}\"\n\n{ai_response}"
-        
-        ai_response += "\n\n---\n📞 शेतकरी हेल्पलाइन: 1551"
+        was_voice = "audio" in media_type
 
-        msg.body(ai_response)
-        logger.info(f"✅ Response sent to {sender_short}")
-        _metrics_inc("wa_success")
-        return str(resp), 200, {"Content-Type": "application/xml"}
+        # Answer out of band when possible so Twilio gets its 200 immediately
+        if WA_ASYNC_REPLIES and twilio_client:
+            job = {"kind": "text", "sender": sender, "reply_from": form.get("To", ""),
+                   "text": incoming_msg, "was_voice": was_voice}
+            return _twiml(_wa_submit(job, WA_EMPTY_TWIML))
+
+        logger.info("🤖 Generating AI response…")
+        twiml = _render_twiml(_wa_answer(sender, incoming_msg, was_voice))
+        logger.info("✅ Response sent to %s", sender_short)
+        _metrics_inc(M_WA_SUCCESS)
+        return _twiml(twiml)
 
     except Exception as e:
         logger.exception("WhatsApp webhook error")
-        resp = MessagingResponse()
-        resp.message("❌ तांत्रिक समस्या. कृपया पुन्हा प्रयत्न करा.\n\n📞 शेतकरी हेल्पलाइन: 1551")
-        _metrics_inc("wa_errors")
-        return str(resp), 200, {"Content-Type": "application/xml"}
+        _metrics_inc(M_WA_ERRORS)
+        return _twiml(WA_ERROR_TWIML)
 
 
 # ---------- Error Handlers ----------
@@ -646,55 +1253,80 @@ def not_found(e):
     return jsonify({"success": False, "error": "Not found"}), 404
 
 
-@app.errorhandler(500)
+@app.errorhandler(429)
+def rate_limited(e):
+    """Handle rate limit hits; WhatsApp senders get a TwiML reply instead of an error"""
+    if request.path == "/whatsapp/webhook":
+        _metrics_inc(M_WA_ERRORS)
+        return _twiml(WA_RATE_LIMITED_TWIML)
+    return jsonify({"success": False, "error": "Too many requests"}), 429
+
+
+SERVER_ERROR_BODY = app.json.dumps({"success": False, "error": "Server error"}).encode()
+# Endpoint -> error counter for routes that track their own failures
+_ENDPOINT_ERROR_METRICS = {"calc_dose": M_CALC_ERRORS, "calc_dose_secure": M_CALC_ERRORS, "calc_dose_batch": M_CALC_ERRORS}
+
+
+@app.errorhandler(Exception)
 def server_error(e):
-    """Handle 500 errors"""
-    return jsonify({"success": False, "error": "Server error"}), 500
+    """Handle 500s and any exception a route let through"""
+    if isinstance(e, HTTPException) and e.code != 500:
+        return e
+    if not isinstance(e, HTTPException):
+        logger.exception("Unhandled error in %s", request.path)
+    metric = _ENDPOINT_ERROR_METRICS.get(request.endpoint)
+    if metric is not None:
+        _metrics_inc(metric)
+    return Response(SERVER_ERROR_BODY, 500, mimetype="application/json")
 
 
 # ---------- API Documentation ----------
 
+API_DOCS_BODY = app.json.dumps({
+    "service": "KrishiGPT API",
+    "version": APP_VERSION,
+    "endpoints": {
+        "GET /": "Web chat interface",
+        "GET /health": "Health check",
+        "GET /healthz": "Health check alias",
+        "GET /metrics": "Usage metrics",
+        "POST /api/chat": "Chat API",
+        "POST /api/chat/stream": "Streaming chat (Server-Sent Events)",
+        "POST /api/chat-secure": "Secure chat (API key required)",
+        "POST /api/calc/dose": "Dosage calculator",
+        "POST /api/calc/dose-secure": "Secure dosage calculator",
+        "POST /api/calc/dose/batch": "Dosage calculator for a list of products",
+        "POST /api/clear-history": "Clear chat history",
+        "GET /api/quick-info/<topic>": "Quick information",
+        "GET /api/schemes": "List all schemes",
+        "GET /api/schemes/<id>": "Get scheme details",
+        "GET /api/schemes/search?q=": "Search schemes",
+        "POST /whatsapp/webhook": "WhatsApp webhook"
+    },
+    "supported_languages": ["Marathi", "Hindi", "English"],
+    "crops_supported": [
+        "Tomato (टोमॅटो)", "Cotton (कापूस)", "Onion (कांदा)",
+        "Soybean (सोयाबीन)", "Wheat (गहू)", "Sugarcane (ऊस)",
+        "Grapes (द्राक्ष)", "Pomegranate (डाळिंब)"
+    ]
+}).encode()
+
+
 @app.route("/api/docs")
 def api_docs():
-    """API documentation endpoint"""
-    return jsonify({
-        "service": "KrishiGPT API",
-        "version": os.getenv("APP_VERSION", "1.0.0"),
-        "endpoints": {
-            "GET /": "Web chat interface",
-            "GET /health": "Health check",
-            "GET /healthz": "Health check alias",
-            "GET /metrics": "Usage metrics",
-            "POST /api/chat": "Chat API",
-            "POST /api/chat-secure": "Secure chat (API key required)",
-            "POST /api/calc/dose": "Dosage calculator",
-            "POST /api/calc/dose-secure": "Secure dosage calculator",
-            "POST /api/clear-history": "Clear chat history",
-            "GET /api/quick-info/<topic>": "Quick information",
-            "GET /api/schemes": "List all schemes",
-            "GET /api/schemes/<id>": "Get scheme details",
-            "GET /api/schemes/search?q=": "Search schemes",
-            "POST /whatsapp/webhook": "WhatsApp webhook"
-        },
-        "supported_languages": ["Marathi", "Hindi", "English"],
-        "crops_supported": [
-            "Tomato (टोमॅटो)", "Cotton (कापूस)", "Onion (कांदा)",
-            "Soybean (सोयाबीन)", "Wheat (गहू)", "Sugarcane (ऊस)",
-            "Grapes (द्राक्ष)", "Pomegranate (डाळिंब)"
-        ]
-    })
+    """API documentation endpoint (static; proxies may cache it for an hour)"""
+    return Response(API_DOCS_BODY, mimetype="application/json",
+                    headers={"Cache-Control": "public, max-age=3600"})
 
 
-# For local development
+# For local development only (FLASK_DEBUG=1 for the reloader/debugger);
+# production runs wsgi:application under gunicorn (see Procfile)
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     
-    print("=" * 60)
-    print(f"🚀 KrishiGPT Server running on http://localhost:{port}")
-    print(f"📱 Web Interface: http://127.0.0.1:{port}")
-    print("=" * 60)
+    logger.info("🚀 KrishiGPT Server running on http://localhost:%s (📱 Web Interface: http://127.0.0.1:%s)", port, port)
     
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1')
 
 # For Vercel serverless deployment
 app = app
\ No newline at end of file
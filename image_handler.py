@@ -31,11 +31,11 @@ def download_twilio_media(media_url, account_sid, auth_token):
         temp_file.write(response.content)
         temp_file.close()
         
-        logger.info(f"Downloaded image to {temp_file.name} ({len(response.content)} bytes)")
+        logger.info("Downloaded image to %s (%d bytes)", temp_file.name, len(response.content))
         return temp_file.name, response.content
         
     except Exception as e:
-        logger.error(f"Failed to download Twilio media: {e}")
+        logger.error("Failed to download Twilio media: %s", e)
         raise
 
 
@@ -115,7 +115,7 @@ def analyze_crop_image_gemini(image_bytes):
         response = requests.post(url, headers=headers, json=payload, timeout=30)
         
         if response.status_code != 200:
-            logger.error(f"Gemini API error: {response.status_code} - {response.text}")
+            logger.error("Gemini API error: %s - %s", response.status_code, response.text)
             return {
                 "success": False,
                 "error": f"API error: {response.status_code}",
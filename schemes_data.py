@@ -280,21 +280,37 @@ SCHEME_ALIASES = {
     "drip": "mahadbt"
 }
 
+# Lookup tables built once at import
+# Exact query -> scheme for ids and aliases; aliases also kept in order for substring matches
+_SCHEME_EXACT = {**{alias: GOVERNMENT_SCHEMES[key] for alias, key in SCHEME_ALIASES.items()}, **GOVERNMENT_SCHEMES}
+_ALIAS_LIST = tuple((alias, GOVERNMENT_SCHEMES[key]) for alias, key in SCHEME_ALIASES.items())
+# (key, scheme, "name short_name benefit" lowercased) for free-text search
+_SCHEME_SEARCH_INDEX = tuple(
+    (key, scheme, "\n".join((scheme["name"], scheme["short_name"], scheme["benefit"])).lower())
+    for key, scheme in GOVERNMENT_SCHEMES.items()
+)
+
 def get_scheme_by_name(query):
     """Find scheme by name or alias"""
     query_lower = query.lower().strip()
     
-    # Direct match
-    if query_lower in GOVERNMENT_SCHEMES:
-        return GOVERNMENT_SCHEMES[query_lower]
+    # Direct id / alias match
+    scheme = _SCHEME_EXACT.get(query_lower)
+    if scheme:
+        return scheme
     
-    # Alias match
-    for alias, scheme_key in SCHEME_ALIASES.items():
+    # Alias contained in the query
+    for alias, scheme in _ALIAS_LIST:
         if alias in query_lower:
-            return GOVERNMENT_SCHEMES[scheme_key]
+            return scheme
     
     return None
 
+def find_schemes(query):
+    """(key, scheme) pairs whose name, short name or benefit contains the query"""
+    query_lower = query.lower()
+    return [(key, scheme) for key, scheme, text in _SCHEME_SEARCH_INDEX if query_lower in text]
+
 def get_all_schemes_summary():
     """Get summary of all schemes in Marathi"""
     summary = "📋 *प्रमुख शासकीय योजना:*\n\n"
@@ -0,0 +1,34 @@
+# scripts/export_embedder_onnx.py
+# One-off: export the semantic-cache embedding model to ONNX and quantize it to INT8.
+# Usage: python scripts/export_embedder_onnx.py [out_dir]
+# Then run the app with SEMANTIC_CACHE_ONNX_DIR=<out_dir>.
+# Needs (build machine only): optimum[exporters], onnxruntime
+
+from __future__ import annotations
+import os
+import sys
+import subprocess
+
+MODEL = os.getenv(
+    "SEMANTIC_CACHE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+
+
+def main():
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else "onnx_embedder"
+    subprocess.run(
+        ["optimum-cli", "export", "onnx", "--model", MODEL, "--task", "feature-extraction", out_dir],
+        check=True,
+    )
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(
+        os.path.join(out_dir, "model.onnx"),
+        os.path.join(out_dir, "model.int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+    print(f"✅ INT8 model written to {out_dir}/model.int8.onnx (tokenizer.json alongside)")
+
+
+if __name__ == "__main__":
+    main()
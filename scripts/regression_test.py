@@ -8,6 +8,11 @@ import time
 import json
 import httpx
 
+# /api/chat allows CHAT_RATE_PER_MIN requests per minute per IP (app default 10);
+# space the cases so a full run never hits 429
+CHAT_RATE_PER_MIN = float(os.getenv("CHAT_RATE_PER_MIN", "10"))
+CASE_INTERVAL_S = 60.0 / CHAT_RATE_PER_MIN + 0.5
+
 DEFAULT_CASES = [
     "कपास में गुलाबी सुंडी का प्रबंधन बताओ",
     "टमाटर की पत्तियां पीली हो रही हैं, क्या करूं?",
@@ -32,6 +37,10 @@ def call_api(api_base: str, message: str) -> tuple[bool, str]:
     url = api_base.rstrip("/") + "/api/chat"
     try:
         r = httpx.post(url, json={"message": message}, timeout=60)
+        if r.status_code == 429:
+            # Someone else used part of this IP's budget; wait one interval and retry once
+            time.sleep(CASE_INTERVAL_S)
+            r = httpx.post(url, json={"message": message}, timeout=60)
         if r.status_code != 200:
             return False, f"HTTP {r.status_code}: {r.text[:200]}"
         data = r.json()
@@ -61,14 +70,15 @@ def main():
         return 1
 
     cases = load_cases()
-    print(f"Testing {len(cases)} cases against {api} ...")
+    print(f"Testing {len(cases)} cases against {api} (one every {CASE_INTERVAL_S:.1f}s) ...")
     ok = 0
     for i, q in enumerate(cases, 1):
+        if i > 1:
+            time.sleep(CASE_INTERVAL_S)
         success, info = call_api(api, q)
         tag = "PASS" if success else "FAIL"
         print(f"{i:02d}. {tag} - {q} -> {info}")
         ok += 1 if success else 0
-        time.sleep(0.5)
 
     print(f"\nSummary: {ok}/{len(cases)} passed")
     return 0 if ok == len(cases) else 1
@@ -38,11 +38,11 @@ def download_twilio_media(media_url, account_sid, auth_token):
         temp_file.write(response.content)
         temp_file.close()
         
-        logger.info(f"Downloaded media to {temp_file.name} ({len(response.content)} bytes)")
+        logger.info("Downloaded media to %s (%d bytes)", temp_file.name, len(response.content))
         return temp_file.name
         
     except Exception as e:
-        logger.error(f"Failed to download Twilio media: {e}")
+        logger.error("Failed to download Twilio media: %s", e)
         raise
 
 
@@ -89,7 +89,7 @@ def transcribe_audio_groq(audio_path):
         }
         
     except Exception as e:
-        logger.error(f"Transcription failed: {e}")
+        logger.error("Transcription failed: %s", e)
         # Clean up temp file on error
         try:
             os.unlink(audio_path)
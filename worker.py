@@ -0,0 +1,47 @@
+# worker.py
+# Delivers queued WhatsApp replies when the web process runs with WA_REPLY_BACKEND=redis
+# (see app.py). Needs REDIS_URL and the Twilio credentials; see Procfile.
+
+import os
+import time
+import logging
+
+import redis
+
+from app import app, WA_QUEUE_KEY, _wa_slots, _wa_start_local
+
+logger = logging.getLogger("krishigpt.worker")
+
+
+def main():
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        raise SystemExit("REDIS_URL is not set")
+    # Own connection without the engine's short socket timeout: BRPOP blocks by design
+    kv = redis.Redis.from_url(redis_url, decode_responses=True)
+    logger.info("📥 WhatsApp reply worker listening on %s", WA_QUEUE_KEY)
+
+    while True:
+        # Take a slot first so the queue stays in Redis while every pool thread is busy
+        _wa_slots.acquire()
+        try:
+            item = kv.brpop(WA_QUEUE_KEY, timeout=5)
+        except redis.RedisError as e:
+            _wa_slots.release()
+            logger.warning("⚠️ Redis queue read failed: %s", e)
+            time.sleep(1)
+            continue
+        if not item:
+            _wa_slots.release()
+            continue
+        try:
+            job = app.json.loads(item[1])
+        except ValueError:
+            _wa_slots.release()
+            logger.warning("Dropping malformed WhatsApp job: %.200s", item[1])
+            continue
+        _wa_start_local(job)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# wsgi.py
+# WSGI entry point for production servers (gunicorn); see Procfile
+
+from app import app
+
+application = app